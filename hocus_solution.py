@@ -2,7 +2,31 @@
 
 # Solving the "hocus" android game.
 
+import array
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import os
+import pickle
+import random
+import re
 import sys
+import tempfile
+import time
+import traceback
+# numpy is an optional dependency (pip install numpy), for --canvas=numpy, --search=numpy
+# and the faster occlusion finding; everything else works without it.
+try:
+  import numpy
+except ImportError:
+  numpy = None  # only needed for the optional numpy code paths
 
 # Input #43:
 #       *
@@ -874,27 +898,26 @@ namesAndInputs = [
     r'        |',
     r'       4*',
   ]],
-  # # simplistic method (topsort) fails
-  #['input66', [
-  #  '0       0',
-  #  '*       *',
-  #  '|\     /|',
-  #  '| \   / |',
-  #  '|  \ /  |',
-  #  '*   \   *',
-  #  '|\ / \ /|',
-  #  '| \   \ |',
-  #  '|/ \ / \|',
-  #  '*   /   *',
-  #  '|\ / \ /|',
-  #  '| \   \ |',
-  #  '|/ \ / \|',
-  #  '*   /   *',
-  #  '|  / \  |',
-  #  '| /   \ |',
-  #  '|/     \|',
-  #  '*       *',
-  #]],
+  ['input66', [  # occlusion cycle: no topsort exists
+    '0       0',
+    '*       *',
+    '|\     /|',
+    '| \   / |',
+    '|  \ /  |',
+    '*   \   *',
+    '|\ / \ /|',
+    '| \   \ |',
+    '|/ \ / \|',
+    '*   /   *',
+    '|\ / \ /|',
+    '| \   \ |',
+    '|/ \ / \|',
+    '*   /   *',
+    '|  / \  |',
+    '| /   \ |',
+    '|/     \|',
+    '*       *',
+  ]],
   ['input67', [
     '    *     ',
     '   /|\    ',
@@ -971,7 +994,7 @@ namesAndInputs = [
     r'   \0/ ',
     r'    *  ',
   ]],
-  ['input73', [  # TODO: picture assert fails for some reason, although algorithm works.  currently hard-coded to not do pic in that case. fix!
+  ['input73', [
     '    0    ',
     '    *    ',
     '   /|\   ',
@@ -1359,29 +1382,377 @@ namesAndInputs = [
   ]],
 ]  # namesAndInputs
 
+# Logging.
+# Each message is on a channel ('main', 'parse', 'picture', 'subgraph', 'search',
+# 'solution', 'timing') and has a level; it's printed iff its level is at most
+# that channel's level, from log_levels or else default_log_level.
+# The args are %-formatted only if the message is printed,
+# and args that are callables are called first, so that expensive values
+# can be passed as lambdas and never computed if the channel is off.
+LOG_SOLUTION = 1  # the solution and timings
+LOG_PROGRESS = 2  # entering and leaving stages, sizes, and the picture
+LOG_DETAIL = 3  # full data structures
+LOG_TRACE = 4  # every step of the searches
+default_log_level = LOG_SOLUTION  # can be overridden by --verbose=<level>
+log_levels = {}  # can be overridden by --verbose=<channel>:<level>,...
+def LogEnabled(channel, level):
+  return level <= log_levels.get(channel, default_log_level)
+def Log(channel, level, format, *args):
+  if level <= log_levels.get(channel, default_log_level):
+    print(format % tuple(arg() if callable(arg) else arg for arg in args))
+
 # Syndrome of a node is the bit pattern of which incident edges exist, in this order:
 #    501
 #     @
 #    432
+# as a 6-bit int: bit idir is set iff there's an edge in direction idir.
 def ComputeSyndromes(nodes, edges):
-  syndromes = [[False]*6 for node in nodes]
+  syndromes = [0]*len(nodes)
   for inode0,inode1 in edges:
     irow0,icol0 = nodes[inode0]
     irow1,icol1 = nodes[inode1]
     assert irow0 < irow1
     if icol0 < icol1:
-      syndromes[inode0][2] = True
-      syndromes[inode1][5] = True
+      syndromes[inode0] |= 1<<2
+      syndromes[inode1] |= 1<<5
     elif icol0 > icol1:
-      syndromes[inode0][4] = True
-      syndromes[inode1][1] = True
+      syndromes[inode0] |= 1<<4
+      syndromes[inode1] |= 1<<1
     else:
-      syndromes[inode1][0] = True
-      syndromes[inode0][3] = True
+      syndromes[inode1] |= 1<<0
+      syndromes[inode0] |= 1<<3
   return syndromes
 
-def MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entrances_and_exits, slack):
-  print("        in MakePicture")
+# The bits of a syndrome, in direction order, e.g. '001110'.
+def SyndromeString(isyndrome):
+  return ''.join('1' if (isyndrome>>idir)&1 else '0' for idir in range(6))
+
+# Order nodes so that each node comes after its predecessors
+# (edges are (pred,succ) pairs).  Ties are broken by the order of nodes,
+# and preds are emitted in the order they appear in edges.
+# Returns (order, cycles), where cycles is a list of the strongly connected
+# components of size > 1; each such component is emitted contiguously,
+# in an arbitrary (but deterministic) order.
+# This is Tarjan's algorithm, run on the reversed graph, with an explicit
+# stack instead of recursion, so it's O(V+E) and can't overflow the stack.
+def TopSort(nodes, edges):
+  assert type(nodes) == list
+  preds = dict((node,[]) for node in nodes)
+  for node0,node1 in edges:
+    preds[node1].append(node0)
+  node2index = {}  # order of discovery
+  node2lowlink = {}
+  stack = []  # nodes whose component hasn't been emitted yet
+  onstack = set()
+  answerList = []
+  cycles = []
+  for root in nodes:
+    if root in node2index:
+      continue
+    node2index[root] = node2lowlink[root] = len(node2index)
+    stack.append(root)
+    onstack.add(root)
+    work = [(root,iter(preds[root]))]
+    while len(work) != 0:
+      node,predsIter = work[-1]
+      for pred in predsIter:
+        if pred not in node2index:
+          node2index[pred] = node2lowlink[pred] = len(node2index)
+          stack.append(pred)
+          onstack.add(pred)
+          work.append((pred,iter(preds[pred])))
+          break
+        elif pred in onstack:
+          node2lowlink[node] = min(node2lowlink[node], node2index[pred])
+      else:
+        # All preds of node are done.
+        work.pop()
+        if len(work) != 0:
+          parent = work[-1][0]
+          node2lowlink[parent] = min(node2lowlink[parent], node2lowlink[node])
+        if node2lowlink[node] == node2index[node]:
+          # node is the root of a strongly connected component;
+          # its members are everything above it on the stack.
+          i = len(stack)-1
+          while stack[i] != node:
+            i -= 1
+          component = stack[i:]
+          del stack[i:]
+          onstack.difference_update(component)
+          # Reverse discovery order, so that (as in the acyclic case)
+          # node comes after the preds it reached.
+          component.reverse()
+          if len(component) > 1:
+            cycles.append(component)
+          answerList += component
+  return answerList,cycles
+
+if True:
+  assert TopSort([], []) == ([],[])
+  assert TopSort([0], []) == ([0],[])
+  assert TopSort([0,1], [(0,1)]) == ([0,1],[])
+  assert TopSort([0,1], [(1,0)]) == ([1,0],[])
+  assert TopSort([0,1,2], [(2,1),(0,2)]) == ([0,2,1],[])
+  assert TopSort([0,1,2,3], [(0,1),(1,2),(2,1),(2,3)]) == ([0,2,1,3],[[2,1]])
+  # Deeper than the default recursion limit (1000), which the recursive version hit.
+  assert TopSort(list(range(5000)), [(i+1,i) for i in range(4999)])[0] == list(reversed(range(5000)))
+
+# periods mean transparent
+node_sprite_NE = [
+  r'../ .',
+  r'./   ',
+  r'*   /',
+  r'|\ / ',
+  r'* * /',
+  r'.\|/.',
+  r'@.*..',
+]
+node_sprite_NW = [
+  r'. \..',
+  r'   \.',
+  r'\   *',
+  r' \ /|',
+  r'\ * *',
+  r'.\|/.',
+  r'..*.@',
+]
+node_sprite_S = [
+  r'..*..',
+  r'./ \.',
+  r'* @ *',
+  r'|\ /|',
+  r'| * |',
+  r'| | |',
+  r'| | |',
+]
+node_sprite = [
+  r'..*..',
+  r'./ \.',
+  r'*   *',
+  r'|\ /|',
+  r'* @ *',
+  r'.\|/.',
+  r'..*..',
+]
+node_sprite_N = [
+  r'| | |',
+  r'| | |',
+  r'| | |',
+  r'| | |',
+  r'* | *',
+  r'.\|/.',
+  r'..@..',
+]
+node_sprite_SE = [
+  r'..*..',
+  r'./ \.',
+  r'@   .',
+  r'|\  .',
+  r'* \ .',
+  r'.\ \.',
+  r'..\ .',
+]
+node_sprite_SW = [
+  r'..*..',
+  r'./ \.',
+  r'.   @',
+  r'.  /|',
+  r'. / *',
+  r'./ /.',
+  r'. /..',
+]
+def FindTheAtSign(sprite):
+  answer = None
+  for irow in range(len(sprite)):
+    for icol in range(len(sprite[irow])):
+      if sprite[irow][icol] == '@':
+        assert answer is None
+        answer = (irow,icol)
+  return answer
+
+# The sprites drawn over each node, in drawing order:
+# (syndrome bit that enables it or None for always, sprite, chars that are xor'ed).
+# A sprite char that is xor'ed erases that same char if it's already there.
+node_sprites = [
+  (1, node_sprite_NE, '|\\'),
+  (5, node_sprite_NW, '/|'),
+  (3, node_sprite_S, '/\\'),
+  (None, node_sprite, '|/\\'),
+  (0, node_sprite_N, '/\\'),
+  (2, node_sprite_SE, '/|'),
+  (4, node_sprite_SW, '\\|'),
+]
+
+# Composite of the node's center '*' and all of its node_sprites,
+# for a syndrome given as a 6-bit int (bit idir set iff there's an edge in direction idir).
+# Each output cell gets a char that depends only on whether the cell
+# previously held one particular char, so the stamp is a list of
+# (deltarow, runs, xors) relative to the node center, where runs is a list of
+# (deltacol, chars) to be slice-assigned, and xors is a list of
+# (deltacol, c, xorc, xorresult) meaning "xorresult if the cell is xorc, else c".
+def MakeNodeStamp(isyndrome):
+  cell2ops = {(0,0): [('*','')]}
+  for ibit,sprite,xorchars in node_sprites:
+    if ibit is None or (isyndrome>>ibit)&1:
+      center_row,center_col = FindTheAtSign(sprite)
+      for ispriterow in range(len(sprite)):
+        for ispritecol in range(len(sprite[ispriterow])):
+          c = sprite[ispriterow][ispritecol]
+          if c != '.':
+            cell2ops.setdefault((ispriterow-center_row,ispritecol-center_col), []).append((c,xorchars))
+  def applyOps(ops, was):
+    for c,xorchars in ops:
+      was = ' ' if c in xorchars and was == c else c
+    return was
+  deltarow2runs = {}
+  deltarow2xors = {}
+  for (deltarow,deltacol),ops in sorted(cell2ops.items()):
+    c = applyOps(ops, None)
+    xorc = ops[0][0]
+    xorresult = applyOps(ops, xorc)
+    if xorresult != c:
+      deltarow2xors.setdefault(deltarow, []).append((deltacol,c,xorc,xorresult))
+    else:
+      runs = deltarow2runs.setdefault(deltarow, [])
+      if len(runs) != 0 and runs[-1][0]+len(runs[-1][1]) == deltacol:
+        runs[-1][1].append(c)
+      else:
+        runs.append((deltacol,[c]))
+  return [(deltarow,deltarow2runs.get(deltarow,[]),deltarow2xors.get(deltarow,[]))
+          for deltarow in sorted(set(deltarow2runs).union(deltarow2xors))]
+
+# Stamps are built on demand, at most once per syndrome per process.
+node_stamps = [None]*64
+def GetNodeStamp(isyndrome):
+  if node_stamps[isyndrome] is None:
+    node_stamps[isyndrome] = MakeNodeStamp(isyndrome)
+  return node_stamps[isyndrome]
+
+# The cells written for each output row of an edge's stroke, by direction,
+# as (first output row relative to upper node's output row, output col step per output row,
+# list of (deltarow,deltacol,c)).
+# The last row is 2 above the lower node's output row.
+# These are the same cells, in the same order, as the canvas='list' loops in MakePicture.
+edge_strokes = {
+  'S': (2, 0, [(0,-2,'|'),(0,-1,' '),(0,0,'|'),(0,1,' '),(0,2,'|')]),
+  'SE': (1, 1, [(1,-1,'\\'),(0,-1,' '),(0,0,'\\'),(0,1,' '),(-1,1,' '),(-1,2,' '),(-2,2,'\\')]),
+  'SW': (1, -1, [(-2,-2,'/'),(-1,-2,' '),(-1,-1,' '),(0,-1,' '),(0,0,'/'),(0,1,' '),(1,1,'/')]),
+}
+
+# GetNodeStamp(isyndrome) as numpy arrays (deltarows, deltacols, c, xorc, xorresult),
+# with xorc 0 (which never occurs on the canvas) for cells that don't xor.
+node_stamp_arrays = [None]*64
+def GetNodeStampArrays(isyndrome):
+  if node_stamp_arrays[isyndrome] is None:
+    cells = []
+    for deltarow,runs,xors in GetNodeStamp(isyndrome):
+      for deltacol,chars in runs:
+        for i,c in enumerate(chars):
+          cells.append((deltarow,deltacol+i,ord(c),0,ord(c)))
+      for deltacol,c,xorc,xorresult in xors:
+        cells.append((deltarow,deltacol,ord(c),ord(xorc),ord(xorresult)))
+    cells = numpy.array(cells, dtype=numpy.int64)
+    node_stamp_arrays[isyndrome] = (cells[:,0], cells[:,1], cells[:,2].astype(numpy.uint8), cells[:,3].astype(numpy.uint8), cells[:,4].astype(numpy.uint8))
+  return node_stamp_arrays[isyndrome]
+
+# Draw the edges and nodes of MakePicture onto a uint8 numpy canvas of ascii codes.
+# All the edges of one direction are rasterized at once; where strokes overlap,
+# the edge later in edge_order wins, just as with canvas='list'.
+def DrawCanvasNumpy(nodes, edges, edge_order, syndromes, minrow, mincol, n_rows_out, n_cols_out, slack):
+  answer = numpy.full((n_rows_out,n_cols_out), ord(' '), dtype=numpy.uint8)
+  nodes_in = numpy.array(nodes, dtype=numpy.int64).reshape(-1,2)
+  irows_out = 4 + (nodes_in[:,0]-minrow)//2 * (6+slack)
+  icols_out = 2 + (nodes_in[:,1]-mincol)//2 * (6+slack)
+
+  if len(edge_order) != 0:
+    edges_in = numpy.array(edges, dtype=numpy.int64).reshape(-1,2)
+    edge2rank = numpy.empty(len(edges), dtype=numpy.int64)
+    edge2rank[numpy.array(edge_order, dtype=numpy.int64)] = numpy.arange(len(edge_order))
+    dcols_in = nodes_in[edges_in[:,1],1] - nodes_in[edges_in[:,0],1]
+    assert numpy.all(nodes_in[edges_in[:,0],0] < nodes_in[edges_in[:,1],0])
+    rows = []
+    cols = []
+    chars = []
+    ranks = []
+    for dirname,is_dir in (('S',dcols_in==0), ('SE',dcols_in>0), ('SW',dcols_in<0)):
+      rowstart,colstep,cells = edge_strokes[dirname]
+      iedges = numpy.nonzero(is_dir)[0]
+      irow0_out = irows_out[edges_in[iedges,0]]
+      icol0_out = icols_out[edges_in[iedges,0]]
+      irow1_out = irows_out[edges_in[iedges,1]]
+      lengths = numpy.maximum(irow1_out-1 - (irow0_out+rowstart), 0)
+      # One entry per (edge, output row) pair.
+      which = numpy.repeat(numpy.arange(len(iedges)), lengths)
+      irow_out = irow0_out[which] + rowstart + (numpy.arange(len(which)) - numpy.repeat(numpy.cumsum(lengths)-lengths, lengths))
+      icol_out = icol0_out[which] + colstep*(irow_out-irow0_out[which])
+      for deltarow,deltacol,c in cells:
+        rows.append(irow_out+deltarow)
+        cols.append(icol_out+deltacol)
+        chars.append(numpy.full(len(which), ord(c), dtype=numpy.uint8))
+        ranks.append(edge2rank[iedges[which]])
+    order = numpy.argsort(numpy.concatenate(ranks), kind='stable')
+    flat = (numpy.concatenate(rows)*n_cols_out + numpy.concatenate(cols))[order]
+    chars = numpy.concatenate(chars)[order]
+    # Last write to each cell wins.
+    flat,ilast = numpy.unique(flat[::-1], return_index=True)
+    answer.flat[flat] = chars[::-1][ilast]
+
+  for inode in range(len(nodes)):
+    isyndrome = syndromes[inode]
+    deltarows,deltacols,c,xorc,xorresult = GetNodeStampArrays(isyndrome)
+    irow_out = irows_out[inode] + deltarows
+    icol_out = icols_out[inode] + deltacols
+    was = answer[irow_out,icol_out]
+    answer[irow_out,icol_out] = numpy.where(was == xorc, xorresult, c)
+  return answer
+
+# For MakePicture's final cleanup pass: the neighbors of a '*' that, if they're
+# the given char, continue an edge through it, in syndrome order,
+# as (deltarow,deltacol,c).
+star_neighbors = [(-1,0,'|'), (-1,1,'/'), (1,1,'\\'), (1,0,'|'), (1,-1,'/'), (-1,-1,'\\')]
+# What a '*' becomes, indexed by the 6-bit mask of which star_neighbors it has.
+# A '*' that's just in the middle of a straight edge becomes part of the edge.
+star_cleanup_table = ['*']*64
+star_cleanup_table[1<<0 | 1<<3] = '|'
+star_cleanup_table[1<<1 | 1<<4] = '/'
+star_cleanup_table[1<<2 | 1<<5] = '\\'
+
+# Turn each '@' into '*', and each '*' into whatever star_cleanup_table says.
+# Replacing a '*' never changes the mask of another '*'
+# (the replacement char is only a neighbor of cells that already had that char),
+# so all the masks can be computed up front.
+def CleanUpStars(answer):
+  n_rows_out = len(answer)
+  n_cols_out = len(answer[0])
+  stars = []
+  for irow in range(n_rows_out):
+    line = ''.join(answer[irow]).replace('@','*')
+    icol = line.find('*')
+    while icol != -1:
+      stars.append((irow,icol))
+      icol = line.find('*', icol+1)
+  for irow,icol in stars:
+    mask = 0
+    for idir,(deltarow,deltacol,c) in enumerate(star_neighbors):
+      jrow = irow + deltarow
+      jcol = icol + deltacol
+      if 0 <= jrow < n_rows_out and 0 <= jcol < n_cols_out and answer[jrow][jcol] == c:
+        mask |= 1<<idir
+    answer[irow][icol] = star_cleanup_table[mask]
+
+# CleanUpStars, for a uint8 numpy canvas of ascii codes.
+def CleanUpStarsNumpy(answer):
+  answer[answer == ord('@')] = ord('*')
+  irows,icols = numpy.nonzero(answer == ord('*'))
+  padded = numpy.pad(answer, 1)  # so neighbors of the border are 0, which matches nothing
+  mask = numpy.zeros(len(irows), dtype=numpy.uint8)
+  for idir,(deltarow,deltacol,c) in enumerate(star_neighbors):
+    mask |= (padded[irows+1+deltarow,icols+1+deltacol] == ord(c)).astype(numpy.uint8) << idir
+  table = numpy.array([ord(c) for c in star_cleanup_table], dtype=numpy.uint8)
+  answer[irows,icols] = table[mask]
+
+def MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entrances_and_exits, slack, canvas='list'):
+  Log('picture', LOG_PROGRESS, "        in MakePicture")
   # If input was this:
   #       *
   #      /|
@@ -1433,56 +1804,25 @@ def MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entran
 
   syndromes = ComputeSyndromes(nodes, edges)
 
-  def syndrome2string(syndrome): return ''.join('1' if x else '0' for x in syndrome)
-  print("          syndromes = %r" % ([syndrome2string(syndrome) for syndrome in syndromes],))
+  Log('picture', LOG_DETAIL, "          syndromes = %r", lambda:[SyndromeString(isyndrome) for isyndrome in syndromes])
 
   # For now, handle edge overlaps by topsort.
-  # Note that, in general, a topsort may not exist!  But I'm not sure
-  # whether there are any of examples of that in the game.
-
-  def topsort(nodes, edges):
-    # cbb: cycle failure is by stack overflow. input66 does this :-(
-    assert type(nodes) == list
-    preds = dict((node,[]) for node in nodes)
-    for node0,node1 in edges:
-      preds[node1].append(node0)
-    answerList = []
-    answerSet = set()
-    def emitPredsAndSelf(node):
-      if node not in answerSet:
-        for pred in preds[node]:
-          emitPredsAndSelf(pred)
-        assert node not in answerSet
-        answerList.append(node)
-        answerSet.add(node)
-    for node in nodes:
-    #for node in reversed(nodes):
-      emitPredsAndSelf(node)
-    return answerList
-
-  if True:
-    assert topsort([], []) == []
-    assert topsort([0], []) == [0]
-    assert topsort([0,1], [(0,1)]) == [0,1]
-    assert topsort([0,1], [(1,0)]) == [1,0]
-    assert topsort([0,1,2], [(2,1),(0,2)]) == [0,2,1]
-
-  edge_order = topsort(list(set(a for a,b in edge_precedences_back_to_front).union(set(b for a,b in edge_precedences_back_to_front))),
-                       edge_precedences_back_to_front)
-  print("          edge_order = %r" % (edge_order,))
-
-  edge_order = topsort(list(range(len(edges))), edge_precedences_back_to_front)
-  print("          edge_order = %r" % (edge_order,))
+  # Note that, in general, a topsort may not exist!  input66 is an example
+  # of that; TopSort draws each cycle's edges together in an arbitrary order.
+  edge_order,edge_order_cycles = TopSort(list(range(len(edges))), edge_precedences_back_to_front)
+  Log('picture', LOG_DETAIL, "          edge_order = %r", edge_order)
+  if len(edge_order_cycles) != 0:
+    Log('picture', LOG_PROGRESS, "          edge_order_cycles = %r", edge_order_cycles)
 
 
   minrow = min(irow for (irow,icol) in nodes)
   maxrow = max(irow for (irow,icol) in nodes)
   mincol = min(icol for (irow,icol) in nodes)
   maxcol = max(icol for (irow,icol) in nodes)
-  print("          minrow = %r" % (minrow,))
-  print("          maxrow = %r" % (maxrow,))
-  print("          mincol = %r" % (mincol,))
-  print("          maxcol = %r" % (maxcol,))
+  Log('picture', LOG_DETAIL, "          minrow = %r", minrow)
+  Log('picture', LOG_DETAIL, "          maxrow = %r", maxrow)
+  Log('picture', LOG_DETAIL, "          mincol = %r", mincol)
+  Log('picture', LOG_DETAIL, "          maxcol = %r", maxcol)
 
   # maxrow-minrow = 0: 9 output rows, 5 output cols
   #     *
@@ -1497,224 +1837,77 @@ def MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entran
   assert (maxrow-minrow)%2 == 0
   assert (maxcol-mincol)%2 == 0
   n_rows_out = 7 + (maxrow-minrow)//2 * (6+slack)
-  print("          n_rows_out = %r" % (n_rows_out,))
+  Log('picture', LOG_DETAIL, "          n_rows_out = %r", n_rows_out)
   n_cols_out = 5 + (maxcol-mincol)//2 * (6+slack)
-  print("          n_cols_out = %r" % (n_cols_out,))
-
-  answer = [[' ' for icol in range(n_cols_out)] for irow in range(n_rows_out)]
-
-
-
-  for iedge in edge_order:
-    inode0,inode1  = edges[iedge]
-    irow0_in,icol0_in = nodes[inode0]
-    irow1_in,icol1_in = nodes[inode1]
-    irow0_out = 4 + (irow0_in-minrow)//2 * (6+slack)
-    icol0_out = 2 + (icol0_in-mincol)//2 * (6+slack)
-    irow1_out = 4 + (irow1_in-minrow)//2 * (6+slack)
-    icol1_out = 2 + (icol1_in-mincol)//2 * (6+slack)
-    assert irow0_in < irow1_in
-
-    # Note that the exact bounds are empirical.  Too short, and it leaves a gap.  Too long, and it interferes with nodes.
-    if icol0_in == icol1_in:
-      # vertical
-      for irow_out in range(irow0_out + 2, irow1_out+1 - 2):
-        answer[irow_out][icol0_out-2] = '|'
-        answer[irow_out][icol0_out-1] = ' '
-        answer[irow_out][icol0_out] = '|'
-        answer[irow_out][icol0_out+1] = ' '
-        answer[irow_out][icol0_out+2] = '|'
-    elif icol0_in < icol1_in:
-      # Pointing SE
-      for irow_out in range(irow0_out + 1, irow1_out+1 - 2):
-        answer[irow_out+1][icol0_out-1 + (irow_out-irow0_out)] = '\\'
-        answer[irow_out+0][icol0_out-1 + (irow_out-irow0_out)] = ' '
-        answer[irow_out][icol0_out + (irow_out-irow0_out)] = '\\'
-        answer[irow_out-0][icol0_out+1 + (irow_out-irow0_out)] = ' '
-        answer[irow_out-1][icol0_out+1 + (irow_out-irow0_out)] = ' '
-        answer[irow_out-1][icol0_out+2 + (irow_out-irow0_out)] = ' '
-        answer[irow_out-2][icol0_out+2 + (irow_out-irow0_out)] = '\\'
-    elif icol0_in > icol1_in:
-      # Pointing SW
-      for irow_out in range(irow0_out + 1, irow1_out+1 - 2):
-        answer[irow_out-2][icol0_out-2 - (irow_out-irow0_out)] = '/'
-        answer[irow_out-1][icol0_out-2 - (irow_out-irow0_out)] = ' '
-        answer[irow_out-1][icol0_out-1 - (irow_out-irow0_out)] = ' '
-        answer[irow_out-0][icol0_out-1 - (irow_out-irow0_out)] = ' '
-        answer[irow_out][icol0_out - (irow_out-irow0_out)] = '/'
-        answer[irow_out+0][icol0_out+1 - (irow_out-irow0_out)] = ' '
-        answer[irow_out+1][icol0_out+1 - (irow_out-irow0_out)] = '/'
-    else:
-      assert False
-
-
-
-  # periods mean transparent
-  node_sprite_NE = [
-    r'../ .',
-    r'./   ',
-    r'*   /',
-    r'|\ / ',
-    r'* * /',
-    r'.\|/.',
-    r'@.*..',
-  ]
-  node_sprite_NW = [
-    r'. \..',
-    r'   \.',
-    r'\   *',
-    r' \ /|',
-    r'\ * *',
-    r'.\|/.',
-    r'..*.@',
-  ]
-  node_sprite_S = [
-    r'..*..',
-    r'./ \.',
-    r'* @ *',
-    r'|\ /|',
-    r'| * |',
-    r'| | |',
-    r'| | |',
-  ]
-  node_sprite = [
-    r'..*..',
-    r'./ \.',
-    r'*   *',
-    r'|\ /|',
-    r'* @ *',
-    r'.\|/.',
-    r'..*..',
-  ]
-  node_sprite_N = [
-    r'| | |',
-    r'| | |',
-    r'| | |',
-    r'| | |',
-    r'* | *',
-    r'.\|/.',
-    r'..@..',
-  ]
-  node_sprite_SE = [
-    r'..*..',
-    r'./ \.',
-    r'@   .',
-    r'|\  .',
-    r'* \ .',
-    r'.\ \.',
-    r'..\ .',
-  ]
-  node_sprite_SW = [
-    r'..*..',
-    r'./ \.',
-    r'.   @',
-    r'.  /|',
-    r'. / *',
-    r'./ /.',
-    r'. /..',
-  ]
-  def findTheAtSign(sprite):
-    answer = None
-    for irow in range(len(sprite)):
-      for icol in range(len(sprite[irow])):
-        if sprite[irow][icol] == '@':
-          assert answer is None
-          answer = (irow,icol)
-    return answer
-  node_sprite_NE_center_row,node_sprite_NE_center_col = findTheAtSign(node_sprite_NE)
-  node_sprite_NW_center_row,node_sprite_NW_center_col = findTheAtSign(node_sprite_NW)
-  node_sprite_S_center_row,node_sprite_S_center_col = findTheAtSign(node_sprite_S)
-  node_sprite_center_row,node_sprite_center_col = findTheAtSign(node_sprite)
-  node_sprite_N_center_row,node_sprite_N_center_col = findTheAtSign(node_sprite_N)
-  node_sprite_SW_center_row,node_sprite_SW_center_col = findTheAtSign(node_sprite_SW)
-  node_sprite_SE_center_row,node_sprite_SE_center_col = findTheAtSign(node_sprite_SE)
-
-  nspriterows = len(node_sprite)
-  nspritecols = len(node_sprite[0])
-  for inode in range(len(nodes)):
-  #for inode in reversed(range(len(nodes))):
-    row_in,col_in = nodes[inode]
-    node_center_row_out = 4 + (row_in-minrow)//2 * (6+slack)
-    node_center_col_out = 2 + (col_in-mincol)//2 * (6+slack)
-    answer[node_center_row_out][node_center_col_out] = '*'
-
-    if syndromes[inode][1]:  # NE
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite_NE[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '|\\' and answer[node_center_row_out + (ispriterow - node_sprite_NE_center_row)][node_center_col_out + (ispritecol - node_sprite_NE_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_NE_center_row)][node_center_col_out + (ispritecol - node_sprite_NE_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_NE_center_row)][node_center_col_out + (ispritecol - node_sprite_NE_center_col)] = c
-
-    if syndromes[inode][5]:  # NW
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite_NW[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '/|' and answer[node_center_row_out + (ispriterow - node_sprite_NW_center_row)][node_center_col_out + (ispritecol - node_sprite_NW_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_NW_center_row)][node_center_col_out + (ispritecol - node_sprite_NW_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_NW_center_row)][node_center_col_out + (ispritecol - node_sprite_NW_center_col)] = c
-
-    if syndromes[inode][3]:  # S
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite_S[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '/\\' and answer[node_center_row_out + (ispriterow - node_sprite_S_center_row)][node_center_col_out + (ispritecol - node_sprite_S_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_S_center_row)][node_center_col_out + (ispritecol - node_sprite_S_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_S_center_row)][node_center_col_out + (ispritecol - node_sprite_S_center_col)] = c
-
-    if True:
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '|/\\' and answer[node_center_row_out + (ispriterow - node_sprite_center_row)][node_center_col_out + (ispritecol - node_sprite_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_center_row)][node_center_col_out + (ispritecol - node_sprite_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_center_row)][node_center_col_out + (ispritecol - node_sprite_center_col)] = c
-
-    if syndromes[inode][0]:  # N
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite_N[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '/\\' and answer[node_center_row_out + (ispriterow - node_sprite_N_center_row)][node_center_col_out + (ispritecol - node_sprite_N_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_N_center_row)][node_center_col_out + (ispritecol - node_sprite_N_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_N_center_row)][node_center_col_out + (ispritecol - node_sprite_N_center_col)] = c
+  Log('picture', LOG_DETAIL, "          n_cols_out = %r", n_cols_out)
 
+  if canvas == 'numpy':
+    assert numpy is not None, "canvas='numpy' requires numpy"
+    answer = DrawCanvasNumpy(nodes, edges, edge_order, syndromes, minrow, mincol, n_rows_out, n_cols_out, slack)
+  else:
+    assert canvas == 'list', "canvas should be 'list' or 'numpy', not %r" % (canvas,)
+    answer = [[' ' for icol in range(n_cols_out)] for irow in range(n_rows_out)]
+
+
+
+    for iedge in edge_order:
+      inode0,inode1  = edges[iedge]
+      irow0_in,icol0_in = nodes[inode0]
+      irow1_in,icol1_in = nodes[inode1]
+      irow0_out = 4 + (irow0_in-minrow)//2 * (6+slack)
+      icol0_out = 2 + (icol0_in-mincol)//2 * (6+slack)
+      irow1_out = 4 + (irow1_in-minrow)//2 * (6+slack)
+      icol1_out = 2 + (icol1_in-mincol)//2 * (6+slack)
+      assert irow0_in < irow1_in
+
+      # Note that the exact bounds are empirical.  Too short, and it leaves a gap.  Too long, and it interferes with nodes.
+      if icol0_in == icol1_in:
+        # vertical
+        for irow_out in range(irow0_out + 2, irow1_out+1 - 2):
+          answer[irow_out][icol0_out-2] = '|'
+          answer[irow_out][icol0_out-1] = ' '
+          answer[irow_out][icol0_out] = '|'
+          answer[irow_out][icol0_out+1] = ' '
+          answer[irow_out][icol0_out+2] = '|'
+      elif icol0_in < icol1_in:
+        # Pointing SE
+        for irow_out in range(irow0_out + 1, irow1_out+1 - 2):
+          answer[irow_out+1][icol0_out-1 + (irow_out-irow0_out)] = '\\'
+          answer[irow_out+0][icol0_out-1 + (irow_out-irow0_out)] = ' '
+          answer[irow_out][icol0_out + (irow_out-irow0_out)] = '\\'
+          answer[irow_out-0][icol0_out+1 + (irow_out-irow0_out)] = ' '
+          answer[irow_out-1][icol0_out+1 + (irow_out-irow0_out)] = ' '
+          answer[irow_out-1][icol0_out+2 + (irow_out-irow0_out)] = ' '
+          answer[irow_out-2][icol0_out+2 + (irow_out-irow0_out)] = '\\'
+      elif icol0_in > icol1_in:
+        # Pointing SW
+        for irow_out in range(irow0_out + 1, irow1_out+1 - 2):
+          answer[irow_out-2][icol0_out-2 - (irow_out-irow0_out)] = '/'
+          answer[irow_out-1][icol0_out-2 - (irow_out-irow0_out)] = ' '
+          answer[irow_out-1][icol0_out-1 - (irow_out-irow0_out)] = ' '
+          answer[irow_out-0][icol0_out-1 - (irow_out-irow0_out)] = ' '
+          answer[irow_out][icol0_out - (irow_out-irow0_out)] = '/'
+          answer[irow_out+0][icol0_out+1 - (irow_out-irow0_out)] = ' '
+          answer[irow_out+1][icol0_out+1 - (irow_out-irow0_out)] = '/'
+      else:
+        assert False
 
-    if syndromes[inode][2]:  # SE
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite_SE[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '/|' and answer[node_center_row_out + (ispriterow - node_sprite_SE_center_row)][node_center_col_out + (ispritecol - node_sprite_SE_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_SE_center_row)][node_center_col_out + (ispritecol - node_sprite_SE_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_SE_center_row)][node_center_col_out + (ispritecol - node_sprite_SE_center_col)] = c
-
-    if syndromes[inode][4]:  # SW
-      for ispriterow in range(nspriterows):
-        for ispritecol in range(nspritecols):
-          c = node_sprite_SW[ispriterow][ispritecol]
-          if c != '.':
-            # xor
-            if c in '\\|' and answer[node_center_row_out + (ispriterow - node_sprite_SW_center_row)][node_center_col_out + (ispritecol - node_sprite_SW_center_col)] == c:
-              answer[node_center_row_out + (ispriterow - node_sprite_SW_center_row)][node_center_col_out + (ispritecol - node_sprite_SW_center_col)] = ' '
-            else:
-              answer[node_center_row_out + (ispriterow - node_sprite_SW_center_row)][node_center_col_out + (ispritecol - node_sprite_SW_center_col)] = c
+
+
+    for inode in range(len(nodes)):
+    #for inode in reversed(range(len(nodes))):
+      row_in,col_in = nodes[inode]
+      node_center_row_out = 4 + (row_in-minrow)//2 * (6+slack)
+      node_center_col_out = 2 + (col_in-mincol)//2 * (6+slack)
+      isyndrome = syndromes[inode]
+      for deltarow,runs,xors in GetNodeStamp(isyndrome):
+        line = answer[node_center_row_out + deltarow]
+        for deltacol,chars in runs:
+          icol_out = node_center_col_out + deltacol
+          line[icol_out:icol_out+len(chars)] = chars
+        for deltacol,c,xorc,xorresult in xors:
+          icol_out = node_center_col_out + deltacol
+          line[icol_out] = xorresult if line[icol_out] == xorc else c
 
   # Question: how do we decide what the picture looks like
   # in the immediate vicinity of a node?
@@ -1854,31 +2047,16 @@ def MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entran
   # Yeah, that's what I did.
 
   # Now the picture is good, except it has some '*'s in the middle of edges.
-  # Do a cleanup pass to remove these.
-  for irow in range(n_rows_out):
-    for icol in range(n_cols_out):
-      if True:
-        # Also remove the '@'s
-        if answer[irow][icol] == '@':
-          answer[irow][icol] = '*'
-      if answer[irow][icol] == '*':
-        syndrome = [False] * 6
-        syndrome[0] = irow-1 >= 0 and answer[irow-1][icol] == '|'
-        syndrome[1] = irow-1 >= 0 and icol+1 < n_cols_out and answer[irow-1][icol+1] == '/'
-        syndrome[2] = irow+1 < n_rows_out and icol+1 < n_cols_out and answer[irow+1][icol+1] == '\\'
-        syndrome[3] = irow+1 < n_rows_out and answer[irow+1][icol] == '|'
-        syndrome[4] = irow+1 < n_rows_out and icol-1 >= 0 and answer[irow+1][icol-1] == '/'
-        syndrome[5] = irow-1 >= 0 and icol-1 >= 0 and answer[irow-1][icol-1] == '\\'
-        syndrome_string = syndrome2string(syndrome)
-        if False: pass
-        elif syndrome_string == '010010': answer[irow][icol] = '/'
-        elif syndrome_string == '100100': answer[irow][icol] = '|'
-        elif syndrome_string == '001001': answer[irow][icol] = '\\'
-
-  # Pad, to make room for numbers
+  # Do a cleanup pass to remove these (and the '@'s).
+  # Then pad, to make room for numbers.
   # TODO: do this earlier
-  answer = [[' '] + line + [' '] for line in answer]
-  answer = [' '*len(answer[0])] + answer + [' '*len(answer[0])]
+  if canvas == 'numpy':
+    CleanUpStarsNumpy(answer)
+    answer = numpy.pad(answer, 1, constant_values=ord(' '))
+  else:
+    CleanUpStars(answer)
+    answer = [[' '] + line + [' '] for line in answer]
+    answer = [[' ']*len(answer[0])] + answer + [[' ']*len(answer[0])]
   n_rows_out += 2
   n_cols_out += 2
 
@@ -1911,334 +2089,1587 @@ def MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entran
       #print("              icol_out = %d" % icol_out)
       was = answer[irow_out][icol_out]
       #answer[irow_out][icol_out] = str(idir)
-      answer[irow_out+dir2delta[idir][0]][icol_out+dir2delta[idir][1]] = str(idir)
+      answer[irow_out+dir2delta[idir][0]][icol_out+dir2delta[idir][1]] = ord(str(idir)) if canvas == 'numpy' else str(idir)
 
 
-  # Convert from arrays of char to strings
-  answer = [''.join(line) for line in answer]
+  # Convert from arrays of char (or the numpy array's rows of bytes) to strings
+  if canvas == 'numpy':
+    answer = [line.tobytes().decode('ascii') for line in answer]
+  else:
+    answer = [''.join(line) for line in answer]
 
-  print("        out MakePicture")
+  Log('picture', LOG_PROGRESS, "        out MakePicture")
   return answer
 
-def process(name, input, slack):
-  print("    in process(name="+name+")")
-  assert len(input) > 0
-  assert len(set([len(line) for line in input])) == 1, "hey! inputs don't have all the same lengths"
-  
-  # Find the nodes (positions)
-  nodes = []
-  for irow in range(len(input)):
-    for icol in range(len(input[irow])):
-      assert input[irow][icol] in ' *|/\\012345'
-      if input[irow][icol] in '*':
-        nodes.append((irow,icol))
-  print("      nodes = %r" % (nodes,))
+# Subnodes are (inode, xyz offset); these are the xyz offsets of the 6 directions
+# (see ComputeSyndromes for the direction numbering).
+idir2dir = ((0,0,1),(-1,0,0),(0,1,0),(0,0,-1),(1,0,0),(0,-1,0))
+
+# How the subnodes at the two ends of an edge are connected,
+# by direction of the edge from its upper node (3=S, 2=SE, 4=SW),
+# as pairs of (upper node's offset, lower node's offset).
+# Simplistic, for starters: no interaction between crossed edges.
+subedge_templates = {
+  3: [((1,0,-1),(1,0,1)), ((-1,0,-1),(-1,0,1)), ((0,1,-1),(0,1,1)), ((0,-1,-1),(0,-1,1))],
+  2: [((1,1,0),(1,-1,0)), ((-1,1,0),(-1,-1,0)), ((0,1,1),(0,-1,1)), ((0,1,-1),(0,-1,-1))],
+  4: [((1,1,0),(-1,1,0)), ((1,-1,0),(-1,-1,0)), ((1,0,1),(-1,0,1)), ((1,0,-1),(-1,0,-1))],
+}
+# The same thing from either end: idir2subedge_map[idir][offset] is the offset
+# it's connected to on the neighbor node in direction idir.
+idir2subedge_map = [{} for idir in range(6)]
+for idir,template in subedge_templates.items():
+  for offset0,offset1 in template:
+    idir2subedge_map[idir][offset0] = offset1
+    idir2subedge_map[(idir+3)%6][offset1] = offset0
+
+# Direction (3=S, 2=SE, 4=SW) of an edge from its upper node.
+def EdgeDir(nodes, edge):
+  inode0,inode1 = edge
+  irow0,icol0 = nodes[inode0]
+  irow1,icol1 = nodes[inode1]
+  assert irow0 < irow1
+  return 3 if icol0 == icol1 else 2 if icol0 < icol1 else 4
+
+# The set of subnode offsets of a node, by its syndrome as a 6-bit int.
+subnode_offsets = [None]*64
+def GetSubnodeOffsets(isyndrome):
+  if subnode_offsets[isyndrome] is None:
+    offsets = set()
+    for idir in range(6):
+      if (isyndrome>>idir)&1:
+        for jdir in range(6):
+          if idir%3 != jdir%3:
+            diri = idir2dir[idir]
+            dirj = idir2dir[jdir]
+            offsets.add((diri[0]+dirj[0],diri[1]+dirj[1],diri[2]+dirj[2]))
+      else:
+        offsets.add(idir2dir[idir])
+    subnode_offsets[isyndrome] = frozenset(offsets)
+  return subnode_offsets[isyndrome]
+
+# A subnode (inode, xyz offset) is also encoded as a single int, inode*27 + offset code,
+# where the offset code of (x,y,z) (each -1, 0 or 1) is its index in the 3x3x3 cube.
+# Encoded subnodes sort in the same order as the tuples.
+def OffsetCode(offset):
+  x,y,z = offset
+  return (x+1)*9 + (y+1)*3 + (z+1)
+code2offset = [(x,y,z) for x in (-1,0,1) for y in (-1,0,1) for z in (-1,0,1)]
+def EncodeSubnode(subnode):
+  inode,offset = subnode
+  return inode*27 + OffsetCode(offset)
+def DecodeSubnode(code):
+  return (code//27, code2offset[code%27])
+
+# The codes of the offsets next to each offset code (differing by 1 in one of x,y,z) within the cube.
+offset_code_neighbors = [[OffsetCode((x+d[0],y+d[1],z+d[2])) for d in ((-1,0,0),(1,0,0),(0,-1,0),(0,1,0),(0,0,-1),(0,0,1))
+                          if max(abs(x+d[0]),abs(y+d[1]),abs(z+d[2])) <= 1]
+                         for x,y,z in code2offset]
+# subedge_templates, as pairs of offset codes.
+subedge_code_templates = dict((idir,[(OffsetCode(offset0),OffsetCode(offset1)) for offset0,offset1 in template])
+                              for idir,template in subedge_templates.items())
+
+if True:
+  assert [OffsetCode(offset) for offset in code2offset] == list(range(27))
+  assert DecodeSubnode(EncodeSubnode((5,(1,0,-1)))) == (5,(1,0,-1))
+  assert sorted(offset_code_neighbors[OffsetCode((0,0,0))]) == [4,10,12,14,16,22]
+  assert len(offset_code_neighbors[OffsetCode((1,1,1))]) == 3
+
+# A node's part of the subgraph, by its syndrome: the sorted offset codes
+# of its subnodes (see GetSubnodeOffsets), and the subedges between them,
+# as pairs of positions in that list.
+subgraph_templates = [None]*64
+def GetSubgraphTemplate(isyndrome):
+  if subgraph_templates[isyndrome] is None:
+    codes = sorted(OffsetCode(offset) for offset in GetSubnodeOffsets(isyndrome))
+    code2position = dict((code,i) for i,code in enumerate(codes))
+    subedges = [(i,code2position[other_code]) for i,code in enumerate(codes)
+                for other_code in offset_code_neighbors[code] if code2position.get(other_code,-1) > i]
+    subgraph_templates[isyndrome] = (codes, sorted(subedges))
+  return subgraph_templates[isyndrome]
+
+if True:
+  # A node with no edges has just the 6 unconnected subnodes of its directions;
+  # one with all 6 edges has the 12 edge midpoints of the cube, also unconnected.
+  assert GetSubgraphTemplate(0) == (sorted(OffsetCode(offset) for offset in idir2dir), [])
+  assert len(GetSubgraphTemplate(63)[0]) == 12 and GetSubgraphTemplate(63)[1] == []
+
+# See if I can actually make the maze.
+# Not sure what subnodes should be yet.
+# Try [inode, xyz offset], encoded as ints (see EncodeSubnode).
+# Each node's subnodes and the subedges between them come from its GetSubgraphTemplate,
+# and since subnodes are sorted by node, its subnodes' indices are consecutive.
+# Returns subnodes (sorted array of encoded subnodes), subnode2index (array indexed
+# by encoded subnode, -1 where there's no such subnode),
+# and subedges (sorted pairs of subnode indices).
+def MakeSubgraph(nodes, edges, syndromes):
+  subnodes = array.array('i')
+  subnode2index = array.array('i', [-1])*(len(nodes)*27)
+  subedges = []
+  for inode,isyndrome in enumerate(syndromes):
+    codes,template_subedges = GetSubgraphTemplate(isyndrome)
+    base = len(subnodes)
+    for i,code in enumerate(codes):
+      subnode2index[inode*27 + code] = base + i
+      subnodes.append(inode*27 + code)
+    subedges += [(base+i,base+j) for i,j in template_subedges]
+  Log('subgraph', LOG_PROGRESS, "      len(subnodes) = %r", len(subnodes))
+  Log('subgraph', LOG_DETAIL, "      subnodes = %r", lambda:[DecodeSubnode(code) for code in subnodes])
+  Log('subgraph', LOG_DETAIL, "      subnode2index = %r", lambda:dict((DecodeSubnode(code),i) for i,code in enumerate(subnodes)))
 
-  node2index = dict((node,i) for i,node in enumerate(nodes))
-  print("      node2index = %r" % (node2index,))
-
-  def findEdgeEndpoints(input,node2index,irow,icol):
-    if input[irow][icol] == '|':
-      delta = (1,0)
-    elif input[irow][icol] == '/':
-      delta = (1,-1)
-    elif input[irow][icol] == '\\':
-      delta = (1,1)
+  for inode0,inode1 in edges:
+    for code0,code1 in subedge_code_templates[EdgeDir(nodes, (inode0,inode1))]:
+      subedges.append((subnode2index[inode0*27 + code0],
+                       subnode2index[inode1*27 + code1]))
+  subedges.sort()
+  Log('subgraph', LOG_DETAIL, "      subedges = %r", subedges)
+  #for i,subedge in enumerate(subedges):
+  #  print("          %d: %r -> %r" % (i, DecodeSubnode(subnodes[subedge[0]]), DecodeSubnode(subnodes[subedge[1]])))
+  return subnodes,subnode2index,subedges
+
+# The index in MakeSubgraph's subnodes of entrance/exit (inode, idir)'s subnode.
+# There's no such subnode if the node has an edge in direction idir, so the input is bad.
+def EntranceSubnodeIndex(subnode2index, inode, idir):
+  isubnode = subnode2index[EncodeSubnode((inode,idir2dir[idir]))]
+  assert isubnode != -1, "entrance/exit at node %d points in direction %d, along one of the node's edges" % (inode, idir)
+  return isubnode
+
+# The subgraph of MakeSubgraph, without materializing it:
+# just the syndromes (as 6-bit ints) and, for each node, its neighbor node
+# in each of the 6 directions (or None).
+# The neighbors of a subnode are generated on demand by ImplicitNeighbors.
+def MakeImplicitGraph(nodes, edges, syndromes):
+  isyndromes = syndromes
+  node2neighbors = [[None]*6 for node in nodes]
+  for inode0,inode1 in edges:
+    idir = EdgeDir(nodes, (inode0,inode1))
+    node2neighbors[inode0][idir] = inode1
+    node2neighbors[inode1][(idir+3)%6] = inode0
+  return isyndromes,node2neighbors
+
+def ImplicitNeighbors(implicit_graph, subnode):
+  isyndromes,node2neighbors = implicit_graph
+  inode,(x,y,z) = subnode
+  offsets = GetSubnodeOffsets(isyndromes[inode])
+  for d in ((-1,0,0),(1,0,0),(0,-1,0),(0,1,0),(0,0,-1),(0,0,1)):
+    other = (x+d[0],y+d[1],z+d[2])
+    if other in offsets:
+      yield (inode,other)
+  for idir in range(6):
+    jnode = node2neighbors[inode][idir]
+    if jnode is not None:
+      other = idir2subedge_map[idir].get((x,y,z))
+      if other is not None:
+        yield (jnode,other)
+
+# Like FindShortestPath, but on an implicit graph from MakeImplicitGraph,
+# with subnodes (inode, xyz offset) themselves rather than indices;
+# only the subnodes actually reached are ever looked at.
+def FindShortestPathImplicit(implicit_graph,subnode0,subnode1,stats=None):
+  trace = LogEnabled('search', LOG_TRACE)  # checked once, since it's in the inner loop
+  Log('search', LOG_PROGRESS, "        in FindShortestPathImplicit")
+  Log('search', LOG_DETAIL, "          subnode0 = %r", subnode0)
+  Log('search', LOG_DETAIL, "          subnode1 = %r", subnode1)
+  # Search outward from subnode0.
+  subnode2pred = {subnode0:None}
+  the_list = [subnode0]
+  i = 0
+  while i < len(the_list) and subnode1 not in subnode2pred:
+    a = the_list[i]
+    if trace: Log('search', LOG_TRACE, "          a = %r", a)
+    for b in ImplicitNeighbors(implicit_graph, a):
+      if b not in subnode2pred:
+        if trace: Log('search', LOG_TRACE, "              b = %r", b)
+        subnode2pred[b] = a
+        the_list.append(b)
+        if b == subnode1:
+          if trace: Log('search', LOG_TRACE, "              done! because b=%r == subnode1=%r", b,subnode1)
+          break
+      else:
+        if trace: Log('search', LOG_TRACE, "              (b = %r seen already)", b)
+    i += 1
+  nexpanded = i
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  if subnode1 in subnode2pred:
+    # Found a path!
+    answer = [subnode1]
+    while answer[-1] != subnode0:
+      answer.append(subnode2pred[answer[-1]])
+    answer.reverse()
+    Log('search', LOG_PROGRESS, "        out FindShortestPathImplicit, found it!")
+    return answer
+  else:
+    Log('search', LOG_PROGRESS, "        out FindShortestPathImplicit, didn't find it")
+    return None
+
+# Undirected graph on nodes 0..nnodes-1, in compressed sparse row form:
+# (offsets, targets), where the neighbors of node a are targets[offsets[a]:offsets[a+1]]
+# (in increasing order, if edges is sorted).
+# That's two ints per edge, and it's built once and shared by all searches on the graph.
+def MakeAdjacency(nnodes, edges):
+  offsets = array.array('i', [0])*(nnodes+1)
+  for a,b in edges:
+    offsets[a+1] += 1
+    offsets[b+1] += 1
+  for a in range(nnodes):
+    offsets[a+1] += offsets[a]
+  targets = array.array('i', [0])*offsets[nnodes]
+  fill = offsets[:nnodes]  # where the next neighbor of each node goes
+  for a,b in edges:
+    targets[fill[a]] = b
+    fill[a] += 1
+    targets[fill[b]] = a
+    fill[b] += 1
+  return offsets,targets
+
+if True:
+  assert MakeAdjacency(0, []) == (array.array('i', [0]), array.array('i'))
+  assert MakeAdjacency(3, [(0,1),(0,2),(1,2)]) == (array.array('i', [0,2,4,6]), array.array('i', [1,2,0,2,0,1]))
+
+# Disjoint-set forest of the connected components of an undirected graph on nodes
+# 0..nnodes-1, built in one pass over edges, with union by rank and path compression.
+# Returns (parents, sizes): following parents from a node leads to the root of
+# its component (see FindRoot), and sizes[root] is the number of nodes in the component.
+def MakeComponents(nnodes, edges):
+  parents = array.array('i', range(nnodes))
+  ranks = bytearray(nnodes)
+  sizes = array.array('i', [1])*nnodes
+  for a,b in edges:
+    a = FindRoot(parents, a)
+    b = FindRoot(parents, b)
+    if a != b:
+      if ranks[a] < ranks[b]:
+        a,b = b,a
+      parents[b] = a
+      sizes[a] += sizes[b]
+      if ranks[a] == ranks[b]:
+        ranks[a] += 1
+  return parents,sizes
+
+# The root of a's component, which identifies it.
+# Also points everything on the way there straight at the root.
+def FindRoot(parents, a):
+  root = a
+  while parents[root] != root:
+    root = parents[root]
+  while parents[a] != root:
+    parents[a],a = root,parents[a]
+  return root
+
+if True:
+  parents,sizes = MakeComponents(5, [(0,1),(3,4),(1,0),(4,1)])
+  assert FindRoot(parents, 0) == FindRoot(parents, 3) != FindRoot(parents, 2)
+  assert sizes[FindRoot(parents, 4)] == 4 and sizes[FindRoot(parents, 2)] == 1
+
+def FindShortestPath(adjacency,node0,node1,node2string,stats=None):
+  trace = LogEnabled('search', LOG_TRACE)  # checked once, since it's in the inner loop
+  Log('search', LOG_PROGRESS, "        in FindShortestPath")
+  Log('search', LOG_DETAIL, "          node0 = %r: %r", node0, lambda:node2string(node0))
+  Log('search', LOG_DETAIL, "          node1 = %r: %r", node1, lambda:node2string(node1))
+  if node1 == node0:
+    if stats is not None: stats['nexpanded'] = 0
+    Log('search', LOG_PROGRESS, "        out FindShortestPath, trivial")
+    return [node0]
+  offsets,targets = adjacency
+  # Search outward from node0.
+  # The subnodes are dense indices, so the state is in flat arrays allocated once:
+  # seen[a] is 1 once a is queued, preds[a] is the node a was reached from,
+  # and queue[:tail] is the nodes in the order they were seen (each one is
+  # queued at most once, so nnodes is enough and it never has to wrap around).
+  nnodes = len(offsets)-1
+  seen = bytearray(nnodes)
+  preds = array.array('i', [-1])*nnodes
+  queue = array.array('i', [0])*nnodes
+  queue[0] = node0
+  seen[node0] = 1
+  i = 0
+  tail = 1
+  found = False
+  while i < tail:
+    a = queue[i]
+    if trace: Log('search', LOG_TRACE, "          a = %r: %s", a, lambda:node2string(a))
+    for b in targets[offsets[a]:offsets[a+1]]:
+      if not seen[b]:
+        if trace: Log('search', LOG_TRACE, "              b = %r: %s", b, lambda:node2string(b))
+        seen[b] = 1
+        queue[tail] = b
+        tail += 1
+        preds[b] = a
+        if b == node1:
+          if trace: Log('search', LOG_TRACE, "              done! because b=%r == node1=%r", b,node1)
+          found = True
+          break
+      else:
+        if trace: Log('search', LOG_TRACE, "              (b = %r seen already)", b)
+        pass
+    if found:
+      if trace: Log('search', LOG_TRACE, "          done!")
+      break
+    i += 1
+  nexpanded = min(i+1, tail)
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  if found:
+    # Found a path!
+    assert queue[tail-1] == node1
+    answer = [node1]
+    while answer[-1] != node0:
+      answer.append(preds[answer[-1]])
+    answer.reverse()
+    Log('search', LOG_PROGRESS, "        out FindShortestPath, found it!")
+    return answer
+  else:
+    Log('search', LOG_PROGRESS, "        out FindShortestPath, didn't find it")
+    return None
+
+# Like FindShortestPath, but with numpy, a whole level at a time:
+# the frontier is an array of nodes, whose neighbors are gathered from the adjacency
+# all at once (the same repeat/arange trick as DrawCanvasNumpy), and the ones not seen
+# already are the next frontier, each with the first frontier node that reached it as its pred.
+# So the python loop is per level, not per node, which is what matters for huge subgraphs.
+# The path found may differ from FindShortestPath's, but is just as short.
+def FindShortestPathNumpy(adjacency,node0,node1,node2string,stats=None):
+  assert numpy is not None, "search='numpy' requires numpy"
+  trace = LogEnabled('search', LOG_TRACE)
+  Log('search', LOG_PROGRESS, "        in FindShortestPathNumpy")
+  Log('search', LOG_DETAIL, "          node0 = %r: %r", node0, lambda:node2string(node0))
+  Log('search', LOG_DETAIL, "          node1 = %r: %r", node1, lambda:node2string(node1))
+  if node1 == node0:
+    if stats is not None: stats['nexpanded'] = 0
+    Log('search', LOG_PROGRESS, "        out FindShortestPathNumpy, trivial")
+    return [node0]
+  # Views of the adjacency's arrays, not copies.
+  offsets = numpy.frombuffer(adjacency[0], dtype=numpy.intc)
+  targets = numpy.frombuffer(adjacency[1], dtype=numpy.intc)
+  nnodes = len(offsets)-1
+  seen = numpy.zeros(nnodes, dtype=bool)
+  preds = numpy.full(nnodes, -1, dtype=numpy.intc)
+  seen[node0] = True
+  frontier = numpy.array([node0], dtype=numpy.intc)
+  nexpanded = 0
+  level = 0
+  while len(frontier) != 0 and not seen[node1]:
+    if trace: Log('search', LOG_TRACE, "          level %d: frontier = %r", level, frontier.tolist())
+    nexpanded += len(frontier)
+    starts = offsets[frontier]
+    lengths = offsets[frontier+1] - starts
+    ends = numpy.cumsum(lengths)
+    sources = numpy.repeat(frontier, lengths)
+    bs = targets[numpy.repeat(starts-(ends-lengths), lengths) + numpy.arange(ends[-1])]
+    unseen = ~seen[bs]
+    # unique's return_index is each one's first occurrence, so its pred is the first frontier node reaching it.
+    frontier,first = numpy.unique(bs[unseen], return_index=True)
+    preds[frontier] = sources[unseen][first]
+    seen[frontier] = True
+    level += 1
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  if seen[node1]:
+    answer = [node1]
+    while answer[-1] != node0:
+      answer.append(int(preds[answer[-1]]))
+    answer.reverse()
+    Log('search', LOG_PROGRESS, "        out FindShortestPathNumpy, found it!")
+    return answer
+  else:
+    Log('search', LOG_PROGRESS, "        out FindShortestPathNumpy, didn't find it")
+    return None
+
+# Like FindShortestPath, but searches outward from both node0 and node1,
+# a whole level at a time from whichever side has the smaller frontier,
+# until the two searches meet.
+# The first meeting found gives a shortest path: when a level of one side
+# is expanded without meeting, every node within that many steps of that side
+# has been seen, so all meetings on the next level give paths of the same length.
+def FindShortestPathBidirectional(adjacency,node0,node1,node2string,stats=None):
+  trace = LogEnabled('search', LOG_TRACE)  # checked once, since it's in the inner loop
+  Log('search', LOG_PROGRESS, "        in FindShortestPathBidirectional")
+  Log('search', LOG_DETAIL, "          node0 = %r: %r", node0, lambda:node2string(node0))
+  Log('search', LOG_DETAIL, "          node1 = %r: %r", node1, lambda:node2string(node1))
+  if node1 == node0:
+    if stats is not None: stats['nexpanded'] = 0
+    Log('search', LOG_PROGRESS, "        out FindShortestPathBidirectional, trivial")
+    return [node0]
+  offsets,targets = adjacency
+  # node2preds[0] is the search from node0, node2preds[1] is the search from node1.
+  node2preds = [{node0:None}, {node1:None}]
+  frontiers = [[node0], [node1]]
+  nexpanded = 0
+  meeting = None
+  while meeting is None and len(frontiers[0]) != 0 and len(frontiers[1]) != 0:
+    side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+    node2pred = node2preds[side]
+    other_node2pred = node2preds[1-side]
+    next_frontier = []
+    for a in frontiers[side]:
+      nexpanded += 1
+      if trace: Log('search', LOG_TRACE, "          side %d: a = %r: %s", side,a, lambda:node2string(a))
+      for b in targets[offsets[a]:offsets[a+1]]:
+        if b not in node2pred:
+          node2pred[b] = a
+          if b in other_node2pred:
+            if trace: Log('search', LOG_TRACE, "              done! because b=%r was seen from the other side", b)
+            meeting = b
+            break
+          next_frontier.append(b)
+      if meeting is not None:
+        break
+    frontiers[side] = next_frontier
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  if meeting is not None:
+    # Found a path!
+    answer = [meeting]
+    while answer[-1] != node0:
+      answer.append(node2preds[0][answer[-1]])
+    answer.reverse()
+    while answer[-1] != node1:
+      answer.append(node2preds[1][answer[-1]])
+    Log('search', LOG_PROGRESS, "        out FindShortestPathBidirectional, found it!")
+    return answer
+  else:
+    Log('search', LOG_PROGRESS, "        out FindShortestPathBidirectional, didn't find it")
+    return None
+
+# Lift each subnode into the 3d space of idir2dir, for FindShortestPathAStar.
+# Input position (irow,icol) is x*(2,-2) + y*(2,2) + z*(-4,0), which only determines
+# (x,y,z) up to adding t*(1,1,1); taking z=0, x = (irow-icol)/4 and y = (irow+icol)/4.
+# A subnode's position is then 2*(x,y,z) + its offset (times 4, to keep it in ints),
+# so that subedges within a node move it one unit (4), and a subedge along an edge
+# of length 1 doesn't move it at all (longer edges move it 2*(length-1) units).
+# The distance between two positions is min over t of the L1 norm of their difference
+# plus t*(1,1,1), which is just the max minus the min of the difference's coordinates.
+# Returns (positions, max_step): each subnode's position as an (x,y,z) array,
+# and the farthest any one subedge moves.
+def LiftSubnodes(nodes, edges, subnodes):
+  positions = tuple(array.array('i', [0])*len(subnodes) for i in range(3))
+  for isubnode,code in enumerate(subnodes):
+    irow,icol = nodes[code//27]
+    x,y,z = code2offset[code%27]
+    positions[0][isubnode] = 2*(irow-icol) + 4*x
+    positions[1][isubnode] = 2*(irow+icol) + 4*y
+    positions[2][isubnode] = 4*z
+  max_step = 4
+  for inode0,inode1 in edges:
+    (irow0,icol0),(irow1,icol1) = nodes[inode0],nodes[inode1]
+    offset0,offset1 = subedge_templates[EdgeDir(nodes, (inode0,inode1))][0]
+    step = (2*((irow1-icol1)-(irow0-icol0)) + 4*(offset1[0]-offset0[0]),
+            2*((irow1+icol1)-(irow0+icol0)) + 4*(offset1[1]-offset0[1]),
+            4*(offset1[2]-offset0[2]))
+    max_step = max(max_step, max(step)-min(step))
+  return positions,max_step
+
+# Like FindShortestPath, but A*, with the lift from LiftSubnodes: no path from a
+# to node1 can have fewer than ceil(distance(a,node1)/max_step) subedges.
+# That's consistent, so each node is expanded at most once.
+# Ties in f are broken toward larger g, i.e. nearer the goal.
+def FindShortestPathAStar(adjacency,node0,node1,node2string,stats=None,lift=None):
+  trace = LogEnabled('search', LOG_TRACE)  # checked once, since it's in the inner loop
+  Log('search', LOG_PROGRESS, "        in FindShortestPathAStar")
+  Log('search', LOG_DETAIL, "          node0 = %r: %r", node0, lambda:node2string(node0))
+  Log('search', LOG_DETAIL, "          node1 = %r: %r", node1, lambda:node2string(node1))
+  assert lift is not None, "FindShortestPathAStar needs lift=LiftSubnodes(...)"
+  offsets,targets = adjacency
+  (xs,ys,zs),max_step = lift
+  x1,y1,z1 = xs[node1],ys[node1],zs[node1]
+  def H(a):
+    dx = x1-xs[a]
+    dy = y1-ys[a]
+    dz = z1-zs[a]
+    return -((min(dx,dy,dz) - max(dx,dy,dz)) // max_step)
+  gs = array.array('i', [-1])*(len(offsets)-1)
+  preds = array.array('i', [-1])*(len(offsets)-1)
+  gs[node0] = 0
+  heap = [(H(node0), 0, node0)]
+  nexpanded = 0
+  while len(heap) != 0:
+    f,minus_g,a = heapq.heappop(heap)
+    if -minus_g != gs[a]:
+      continue  # stale
+    if a == node1:
+      break
+    nexpanded += 1
+    if trace: Log('search', LOG_TRACE, "          a = %r: %s, g = %d, f = %d", a, lambda:node2string(a), -minus_g, f)
+    g = gs[a] + 1
+    for b in targets[offsets[a]:offsets[a+1]]:
+      if gs[b] == -1 or g < gs[b]:
+        gs[b] = g
+        preds[b] = a
+        heapq.heappush(heap, (g + H(b), -g, b))
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  if gs[node1] != -1:
+    # Found a path!
+    answer = [node1]
+    while answer[-1] != node0:
+      answer.append(preds[answer[-1]])
+    answer.reverse()
+    Log('search', LOG_PROGRESS, "        out FindShortestPathAStar, found it!")
+    return answer
+  else:
+    Log('search', LOG_PROGRESS, "        out FindShortestPathAStar, didn't find it")
+    return None
+
+# Like FindShortestPath, but with weights that mean something in the game:
+# a subedge within a node costs 0 and a subedge along an edge costs 1, so the path
+# has the fewest node moves.  That's a 0-1 BFS: nodes reached at cost 0 go on the
+# front of the deque and nodes reached at cost 1 on the back, so they come off the
+# front in order of cost, and it's linear in the size of the graph.
+# subnodes (encoded, from MakeSubgraph) says which subedges are within a node.
+# If turns, it finds the path with the fewest turns instead: each node move costs 1
+# if it's in a different direction from the one before it, and 0 otherwise.
+# Then the search is over (subnode, heading) states, where heading is which of the
+# 6 directions the last node move was in, or none yet.
+def FindShortestPath01(adjacency,node0,node1,node2string,stats=None,subnodes=None,turns=False):
+  trace = LogEnabled('search', LOG_TRACE)  # checked once, since it's in the inner loop
+  Log('search', LOG_PROGRESS, "        in FindShortestPath01(turns=%r)", turns)
+  Log('search', LOG_DETAIL, "          node0 = %r: %r", node0, lambda:node2string(node0))
+  Log('search', LOG_DETAIL, "          node1 = %r: %r", node1, lambda:node2string(node1))
+  assert subnodes is not None, "FindShortestPath01 needs subnodes=(encoded subnodes from MakeSubgraph)"
+  offsets,targets = adjacency
+  # A node move from offset code a to offset code b is along the axis where their
+  # offsets differ by 2 (see subedge_templates), so their difference is one of these.
+  heading2index = {-18:0, 18:1, -6:2, 6:3, -2:4, 2:5}
+  nheadings = 7 if turns else 1  # with 6 meaning none yet
+  start = node0*nheadings + nheadings-1
+  costs = array.array('i', [-1])*(len(subnodes)*nheadings)
+  preds = array.array('i', [-1])*(len(subnodes)*nheadings)
+  expanded = bytearray(len(subnodes)*nheadings)
+  costs[start] = 0
+  deque = collections.deque([start])
+  nexpanded = 0
+  done = None
+  while len(deque) != 0:
+    state = deque.popleft()
+    a,heading = divmod(state, nheadings)
+    if a == node1:
+      done = state
+      break
+    if expanded[state]:
+      continue  # a stale entry; it was expanded at a lower cost
+    expanded[state] = 1
+    nexpanded += 1
+    if trace: Log('search', LOG_TRACE, "          a = %r: %s, heading %d, cost %d", a, lambda:node2string(a), heading, costs[state])
+    cost = costs[state]
+    code_a = subnodes[a]
+    for b in targets[offsets[a]:offsets[a+1]]:
+      code_b = subnodes[b]
+      if code_b//27 == code_a//27:
+        next_state,weight = b*nheadings + heading,0
+      elif turns:
+        next_heading = heading2index[code_b%27 - code_a%27]
+        next_state,weight = b*nheadings + next_heading,(0 if heading in (next_heading, 6) else 1)
+      else:
+        next_state,weight = b,1
+      if costs[next_state] == -1 or cost + weight < costs[next_state]:
+        costs[next_state] = cost + weight
+        preds[next_state] = state
+        if weight == 0:
+          deque.appendleft(next_state)
+        else:
+          deque.append(next_state)
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  if done is not None:
+    # Found a path!
+    Log('search', LOG_PROGRESS, "          cost = %r", costs[done])
+    answer = [done]
+    while answer[-1] != start:
+      answer.append(preds[answer[-1]])
+    answer.reverse()
+    Log('search', LOG_PROGRESS, "        out FindShortestPath01, found it!")
+    return [state//nheadings for state in answer]
+  else:
+    Log('search', LOG_PROGRESS, "        out FindShortestPath01, didn't find it")
+    return None
+
+# Shortest paths between all pairs of sources (node indices, all different),
+# by one BFS over the shared adjacency from each source but the last,
+# stopping as soon as it has reached all the later sources it can reach,
+# which components (from MakeComponents) says; if it's None, each BFS runs to exhaustion.
+# Returns (distances, preds): distances[i][j] is the number of edges on a shortest path
+# between sources[i] and sources[j], or None if there isn't one, and preds[i] is the
+# BFS tree from sources[i] (each reached node's predecessor, -1 for the rest),
+# which has the paths from sources[i] to sources[j] for each j > i; see PathFromPreds.
+def FindAllPairsShortestPaths(adjacency,sources,components=None,stats=None):
+  Log('search', LOG_PROGRESS, "        in FindAllPairsShortestPaths")
+  Log('search', LOG_DETAIL, "          sources = %r", sources)
+  offsets,targets = adjacency
+  nnodes = len(offsets)-1
+  distances = [[None]*len(sources) for source in sources]
+  preds = []
+  nexpanded = 0
+  for i,source in enumerate(sources):
+    distances[i][i] = 0
+    pred = array.array('i', [-1])*nnodes
+    preds.append(pred)
+    node2j = dict((sources[j],j) for j in range(i+1,len(sources)))
+    if components is not None:
+      parents,sizes = components
+      root = FindRoot(parents, source)
+      nremaining = sum(1 for other in node2j if FindRoot(parents, other) == root)
     else:
-      return None,None
-    jrow0,jcol0 = irow,icol
-    while input[jrow0][jcol0] not in '*':
-      jrow0 -= delta[0]
-      jcol0 -= delta[1]
-    jrow1,jcol1 = irow,icol
-    while input[jrow1][jcol1] not in '*':
-      jrow1 += delta[0]
-      jcol1 += delta[1]
-    return node2index[(jrow0,jcol0)], node2index[(jrow1,jcol1)]
-
-  # Find the edges (pairs of indices into nodes).
-  # If this gets an out-of-bounds exception, it means input was bogus.
-  edges = set()
-  for irow in range(len(input)):
-    for icol in range(len(input[irow])):
-      inode0,inode1 = findEdgeEndpoints(input,node2index,irow,icol)
-      if inode0 is not None:
-        edges.add((inode0,inode1))
-  edges = sorted(edges)  # convert set to list
-  print("      edges = %r" % (edges,))
-  edge2index = dict((edge,i) for i,edge in enumerate(edges))
-  print("      edge2index = %r" % (edge2index,))
-
-  # Figure out edge occlusions, if any.
-  edge_precedences_back_to_front = set()
-  for irow in range(len(input)):
-    for icol in range(len(input[irow])):
-      if input[irow][icol] == '|':
-        deltarow,deltacol = (1,0)
-      elif input[irow][icol] == '/':
-        deltarow,deltacol = (1,-1)
-      elif input[irow][icol] == '\\':
-        deltarow,deltacol = (1,1)
+      nremaining = len(node2j)
+    dist = array.array('i', [-1])*nnodes
+    dist[source] = 0
+    queue = array.array('i', [source])
+    head = 0
+    while nremaining != 0 and head < len(queue):
+      a = queue[head]
+      head += 1
+      for b in targets[offsets[a]:offsets[a+1]]:
+        if dist[b] == -1:
+          dist[b] = dist[a] + 1
+          pred[b] = a
+          queue.append(b)
+          j = node2j.get(b)
+          if j is not None:
+            distances[i][j] = distances[j][i] = dist[b]
+            nremaining -= 1
+    nexpanded += head
+  if stats is not None: stats['nexpanded'] = nexpanded
+  Log('search', LOG_PROGRESS, "          nexpanded = %r", nexpanded)
+  Log('search', LOG_PROGRESS, "        out FindAllPairsShortestPaths")
+  return distances,preds
+
+# The path from source to target in a BFS tree from FindAllPairsShortestPaths, or None.
+def PathFromPreds(pred,source,target):
+  if target != source and pred[target] == -1:
+    return None
+  answer = [target]
+  while answer[-1] != source:
+    answer.append(pred[answer[-1]])
+  answer.reverse()
+  return answer
+
+if True:
+  # A path 0-1-2-3 and a separate 4.
+  adjacency = MakeAdjacency(5, [(0,1),(1,2),(2,3)])
+  for components in (None, MakeComponents(5, [(0,1),(1,2),(2,3)])):
+    distances,preds = FindAllPairsShortestPaths(adjacency, [3,0,4,1], components)
+    assert distances == [[0,3,None,2],[3,0,None,1],[None,None,0,None],[2,1,None,0]]
+    assert PathFromPreds(preds[0], 3, 0) == [3,2,1,0] and PathFromPreds(preds[0], 3, 4) is None
+
+# The ways process() can search the subgraph, selected by --search=<name>.
+# Some of them need more than the adjacency; see SearchKwargs.
+searches = {
+  'bfs': FindShortestPath,
+  'bidirectional': FindShortestPathBidirectional,
+  'astar': FindShortestPathAStar,
+  '01bfs': FindShortestPath01,
+  'turns': functools.partial(FindShortestPath01, turns=True),
+  'numpy': FindShortestPathNumpy,
+}
+
+# The extra keyword args that searches[search] needs, for the subgraph from MakeSubgraph.
+def SearchKwargs(search, nodes, edges, subnodes):
+  if search == 'astar':
+    return {'lift': LiftSubnodes(nodes, edges, subnodes)}
+  elif search in ('01bfs', 'turns'):
+    return {'subnodes': subnodes}
+  else:
+    return {}
+
+# Counting and listing the shortest solutions, as nodepaths (the sequences of nodes
+# that paths go through), since many paths of subnodes make the same moves in the game.
+# Shortest is in node moves, as in FindShortestPath01.
+# The nodepaths are the paths in a graph of states (inode, mask), where mask is the set
+# of inode's subnodes (as bits, by position among its subnodes) that the nodepath so far
+# can end at; that depends only on the nodepath, so distinct paths of states are
+# distinct nodepaths.  Only the states that are still on some shortest path are kept:
+# those from which the exit is exactly as many node moves away as there are moves left,
+# which the distances from the exit say.  So every state leads to the exit, each state
+# is in just one layer (by number of moves so far), and counting is a DP over the layers.
+# Returns (nmoves, start, Successors), where Successors(state) is the list of next states
+# in order of inode; nmoves is None if there's no path.
+def MakeNodepathLayers(adjacency, subnodes, isubnode0, isubnode1):
+  offsets,targets = adjacency
+  nsubnodes = len(subnodes)
+  # Each node's subnodes are consecutive, from starts[inode].
+  starts = {}
+  for isubnode in range(nsubnodes-1, -1, -1):
+    starts[subnodes[isubnode]//27] = isubnode
+  # Each subnode's set of subnodes connected to it within its node, as a mask.
+  # And the node moves from each subnode to isubnode1, by 0-1 BFS (see FindShortestPath01).
+  closures = [0]*nsubnodes
+  for isubnode in range(nsubnodes):
+    if closures[isubnode] == 0:
+      start = starts[subnodes[isubnode]//27]
+      component = [isubnode]
+      for a in component:
+        for b in targets[offsets[a]:offsets[a+1]]:
+          if subnodes[b]//27 == subnodes[a]//27 and b not in component:
+            component.append(b)
+      mask = sum(1<<(a-start) for a in component)
+      for a in component:
+        closures[a] = mask
+  distances = array.array('i', [-1])*nsubnodes
+  distances[isubnode1] = 0
+  deque = collections.deque([isubnode1])
+  while len(deque) != 0:
+    a = deque.popleft()
+    for b in targets[offsets[a]:offsets[a+1]]:
+      weight = 0 if subnodes[b]//27 == subnodes[a]//27 else 1
+      if distances[b] == -1 or distances[a] + weight < distances[b]:
+        distances[b] = distances[a] + weight
+        if weight == 0:
+          deque.appendleft(b)
+        else:
+          deque.append(b)
+  def Distance(inode, mask):
+    start = starts[inode]
+    return min(distances[start+i] for i in range(mask.bit_length()) if (mask>>i)&1)
+  def Successors(state):
+    inode,mask = state
+    start = starts[inode]
+    nmoves_left = Distance(inode, mask)
+    next_masks = collections.defaultdict(int)
+    for i in range(mask.bit_length()):
+      if (mask>>i)&1:
+        a = start + i
+        for b in targets[offsets[a]:offsets[a+1]]:
+          jnode = subnodes[b]//27
+          if jnode != inode:
+            next_masks[jnode] |= closures[b]
+    return [(jnode,next_mask) for jnode,next_mask in sorted(next_masks.items())
+            if Distance(jnode, next_mask) == nmoves_left-1]
+  if distances[isubnode0] == -1:
+    return None,None,Successors
+  return distances[isubnode0],(subnodes[isubnode0]//27,closures[isubnode0]),Successors
+
+# The number of shortest nodepaths, from MakeNodepathLayers (a python int, so it can't overflow).
+def CountShortestNodepaths(layers):
+  nmoves,start,Successors = layers
+  if nmoves is None:
+    return 0
+  counts = {start: 1}
+  for imove in range(nmoves):
+    next_counts = collections.defaultdict(int)
+    for state,count in counts.items():
+      for next_state in Successors(state):
+        next_counts[next_state] += count
+    counts = next_counts
+  return sum(counts.values())
+
+# Generate the shortest nodepaths, from MakeNodepathLayers, one at a time;
+# since every state leads to the exit, each one takes O(nmoves) Successors calls.
+def GenerateShortestNodepaths(layers):
+  nmoves,start,Successors = layers
+  if nmoves is None:
+    return
+  stack = [iter([start])]  # the rest of the choices at each step so far
+  states = []
+  while len(stack) != 0:
+    state = next(stack[-1], None)
+    if state is None:
+      stack.pop()
+      if len(states) != 0:
+        states.pop()
+      continue
+    states.append(state)
+    if len(states) == nmoves+1:
+      yield [inode for inode,mask in states]
+      states.pop()
+    else:
+      stack.append(iter(Successors(state)))
+
+if True:
+  # Two nodes 0 and 1 with subnodes 0,1 and 2,3; 0-1 and 2-3 within the nodes, 1-2 and 0-3 between.
+  # So 2 shortest paths of subnodes from 0 to 3 but just one nodepath, [0,1].
+  layers = MakeNodepathLayers(MakeAdjacency(4, [(0,1),(0,3),(1,2),(2,3)]), array.array('i', [0,1,27,28]), 0, 3)
+  assert layers[0] == 1 and CountShortestNodepaths(layers) == 1
+  assert list(GenerateShortestNodepaths(layers)) == [[0,1]]
+
+# Parsing the input, in stages.
+
+# Classify every non-blank cell of the input, in a single pass.
+# Returns (nodes, strokes, digits, errors): the (irow,icol) of each '*',
+# and the (irow,icol,c) of each stroke ('|', '/', '\\'), each entrance/exit digit,
+# and each char that shouldn't be there at all.  All are in row-major order.
+lex_pattern = re.compile(r'(\*)|([|/\\])|([0-5])|([^ ])')
+def LexInput(input):
+  nodes = []
+  strokes = []
+  digits = []
+  errors = []
+  for irow,line in enumerate(input):
+    for match in lex_pattern.finditer(line):
+      kind = match.lastindex
+      if kind == 1:
+        nodes.append((irow,match.start()))
       else:
+        (strokes,digits,errors)[kind-2].append((irow,match.start(),match.group()))
+  return nodes,strokes,digits,errors
+
+if True:
+  assert LexInput(['*|2', '/\\x']) == ([(0,0)], [(0,1,'|'),(1,0,'/'),(1,1,'\\')], [(0,2,'2')], [(1,2,'x')])
+
+def FindEdgeEndpoints(input,node2index,irow,icol):
+  if input[irow][icol] == '|':
+    delta = (1,0)
+  elif input[irow][icol] == '/':
+    delta = (1,-1)
+  elif input[irow][icol] == '\\':
+    delta = (1,1)
+  else:
+    return None,None
+  jrow0,jcol0 = irow,icol
+  while input[jrow0][jcol0] not in '*':
+    jrow0 -= delta[0]
+    jcol0 -= delta[1]
+  jrow1,jcol1 = irow,icol
+  while input[jrow1][jcol1] not in '*':
+    jrow1 += delta[0]
+    jcol1 += delta[1]
+  return node2index[(jrow0,jcol0)], node2index[(jrow1,jcol1)]
+
+# Direction (deltarow,deltacol) down along a stroke.
+stroke_deltas = {'|': (1,0), '/': (1,-1), '\\': (1,1)}
+
+# Find the edges (pairs of indices into nodes), sorted, by tracing each one
+# down from its upper node, once.  Also returns labels: for each row, an array
+# of the index of the edge whose stroke is drawn in each cell, or -1.
+# A stroke that doesn't start right next to its upper node (e.g. under a crossing)
+# isn't reached that way, so its cells are looked up by FindEdgeEndpoints instead.
+# If this gets an out-of-bounds exception, it means input was bogus.
+def FindEdges(input,node2index,strokes):
+  labels = [array.array('i', [-1])*len(line) for line in input]
+  edges = []  # in the order found, until sorted at the end
+  edge2index = {}
+  for (irow,icol),inode0 in node2index.items():
+    for c,(deltarow,deltacol) in stroke_deltas.items():
+      jrow,jcol = irow+deltarow,icol+deltacol
+      if jrow >= len(input) or not 0 <= jcol < len(input[jrow]) or input[jrow][jcol] != c:
         continue
-      for sign in (-1,1):
-        if (irow+sign*deltarow >= 0 and irow+sign*deltarow < len(input) and
-            icol+sign*deltacol >= 0 and icol+sign*deltacol < len(input[irow+sign*deltarow]) and
-            input[irow+sign*deltarow][icol+sign*deltacol] != input[irow][icol] and input[irow+sign*deltarow][icol+sign*deltacol] in '|/\\'):
-            # This edge is under the other edge.
-            edge0 = edge2index[findEdgeEndpoints(input,node2index,irow,icol)]
-            edge1 = edge2index[findEdgeEndpoints(input,node2index,irow+sign*deltarow,icol+sign*deltacol)]
-            edge_precedences_back_to_front.add((edge0,edge1))
-  edge_precedences_back_to_front = sorted(edge_precedences_back_to_front)  # convert set to list
-  print("      edge_precedences_back_to_front = %r" % (edge_precedences_back_to_front,))
+      iedge = len(edges)
+      while input[jrow][jcol] != '*':
+        if input[jrow][jcol] == c:
+          labels[jrow][jcol] = iedge
+        jrow += deltarow
+        jcol += deltacol
+      edges.append((inode0,node2index[(jrow,jcol)]))
+      edge2index[edges[-1]] = iedge
+  for irow,icol,c in strokes:
+    if labels[irow][icol] == -1:
+      edge = FindEdgeEndpoints(input,node2index,irow,icol)
+      if edge not in edge2index:
+        edge2index[edge] = len(edges)
+        edges.append(edge)
+      labels[irow][icol] = edge2index[edge]
+  # Renumber in sorted order.
+  order = sorted(range(len(edges)), key=edges.__getitem__)
+  rank = [None]*len(edges)
+  for i,iedge in enumerate(order):
+    rank[iedge] = i
+  for irow,icol,c in strokes:
+    labels[irow][icol] = rank[labels[irow][icol]]
+  return [edges[iedge] for iedge in order],labels
+
+# Figure out edge occlusions, if any: sorted pairs of (under edge, over edge) indices.
+# A stroke is under another edge where the next cell along it has a different stroke,
+# which is the other edge's, according to labels from FindEdges.
+def FindOcclusions(input,labels,strokes):
+  edge_precedences_back_to_front = set()
+  for irow,icol,c in strokes:
+    deltarow,deltacol = stroke_deltas[c]
+    for sign in (-1,1):
+      jrow,jcol = irow+sign*deltarow,icol+sign*deltacol
+      if (0 <= jrow < len(input) and 0 <= jcol < len(input[jrow]) and
+          input[jrow][jcol] != c and input[jrow][jcol] in '|/\\'):
+        edge_precedences_back_to_front.add((labels[irow][icol],labels[jrow][jcol]))
+  return sorted(edge_precedences_back_to_front)  # convert set to list
+
+# FindOcclusions, vectorized with numpy: for each stroke direction, compare the
+# grid with itself shifted one cell along that direction, and look up the
+# (under, over) labels of all the crossings at once.  Same result as FindOcclusions.
+def FindOcclusionsNumpy(input,labels,strokes):
+  nrows,ncols = len(input),len(input[0])
+  grid = numpy.frombuffer(''.join(input).encode('ascii'), dtype=numpy.uint8).reshape(nrows,ncols)
+  label_grid = numpy.frombuffer(b''.join(labels), dtype=numpy.intc).reshape(nrows,ncols)
+  is_stroke = (grid == ord('|')) | (grid == ord('/')) | (grid == ord('\\'))
+  unders = []
+  overs = []
+  for c,(deltarow,deltacol) in stroke_deltas.items():
+    # upper[i] and lower[i] are consecutive cells along this direction.
+    upper = numpy.s_[:-1, max(0,-deltacol):ncols-max(0,deltacol)]
+    lower = numpy.s_[1:, max(0,deltacol):ncols-max(0,-deltacol)]
+    upper_is_c = grid[upper] == ord(c)
+    lower_is_c = grid[lower] == ord(c)
+    for under,over,mask in ((upper, lower, upper_is_c & is_stroke[lower] & ~lower_is_c),
+                            (lower, upper, lower_is_c & is_stroke[upper] & ~upper_is_c)):
+      unders.append(label_grid[under][mask])
+      overs.append(label_grid[over][mask])
+  pairs = numpy.unique(numpy.concatenate(unders).astype(numpy.int64) << 32 | numpy.concatenate(overs))
+  return [(int(pair >> 32),int(pair & 0xffffffff)) for pair in pairs]
+
+# The numpy version, if numpy is there.
+find_occlusions = FindOcclusions if numpy is None else FindOcclusionsNumpy
+
+# Where an entrance/exit digit can be, relative to its node, by direction number.
+dirss = [
+  ((-1,0),),
+  ((-1,1),(0,1)),
+  ((1,1),(0,1)),
+  ((1,0),),
+  ((1,-1),(0,-1)),
+  ((-1,-1),(0,-1)),
+]
+
+# Find entrances/exits: list of (inode, direction number).
+# These are numbers near nodes, roughly in the numbered direction from the node,
+# although sometimes a bit off in order to work around essential parts of the picture.
+# The digits are from LexInput.
+def FindEntrancesAndExits(node2index,digits):
+  entrances_and_exits = []
+  for irow,icol,c in digits:
+    Log('parse', LOG_DETAIL, "  found %r at irow=%d icol=%d", c, irow, icol)
+    dirs = dirss[int(c)]
+    inode = None
+    for dir in dirs:
+      rough_irow = irow - dir[0]
+      rough_icol = icol - dir[1]
+      Log('parse', LOG_DETAIL, "      rough_irow = %r", rough_irow)
+      Log('parse', LOG_DETAIL, "      rough_icol = %r", rough_icol)
+      if (rough_irow,rough_icol) in node2index:
+        assert inode == None
+        inode = node2index[(rough_irow,rough_icol)]
+    assert inode is not None
+    entrances_and_exits.append((inode,int(c)))
+  return entrances_and_exits
+
+# All the parsing stages.
+# Returns (nodes, edges, edge_precedences_back_to_front, entrances_and_exits).
+def ParseInput(input):
+  assert len(input) > 0
+  assert len(set([len(line) for line in input])) == 1, "hey! inputs don't have all the same lengths"
+  nodes,strokes,digits,errors = LexInput(input)
+  assert len(errors) == 0, "bad chars (irow,icol,c) in input: %r" % (errors,)
+  Log('parse', LOG_DETAIL, "      nodes = %r", nodes)
+  node2index = dict((node,i) for i,node in enumerate(nodes))
+  Log('parse', LOG_DETAIL, "      node2index = %r", node2index)
+  edges,labels = FindEdges(input,node2index,strokes)
+  Log('parse', LOG_DETAIL, "      edges = %r", edges)
+  Log('parse', LOG_DETAIL, "      edge2index = %r", lambda:dict((edge,i) for i,edge in enumerate(edges)))
+  edge_precedences_back_to_front = find_occlusions(input,labels,strokes)
+  Log('parse', LOG_DETAIL, "      edge_precedences_back_to_front = %r", edge_precedences_back_to_front)
+  entrances_and_exits = FindEntrancesAndExits(node2index,digits)
+  Log('parse', LOG_DETAIL, "      entrances_and_exits = %r", entrances_and_exits)
+  return nodes,edges,edge_precedences_back_to_front,entrances_and_exits
+
+def FindDirName(node0,node1):
+  row0,col0 = node0
+  row1,col1 = node1
+  if col0 == col1:
+    if row0 < row1:
+      return "S"
+    else:
+      return "N"
+  elif col0 < col1:
+    if row0 < row1:
+      return "SE"
+    else:
+      return "NE"
+  else:
+    assert col0 > col1
+    if row0 < row1:
+      return "SW"
+    else:
+      return "NW"
+
+# Puzzles as text: each puzzle is a line '>name' followed by its rows.
+# When reading, rows are padded with spaces to the longest row of the puzzle,
+# and trailing empty rows are dropped, so that hand-edited files needn't be exact.
+# ReadPuzzles yields (name, input) as soon as each puzzle has been read,
+# so a stream of any number of puzzles can be processed in constant memory.
+def ReadPuzzles(file):
+  name = None
+  rows = []
+  def Puzzle():
+    while len(rows) != 0 and rows[-1].strip() == '':
+      rows.pop()
+    ncols = max([len(row) for row in rows] + [0])
+    return name,[row.ljust(ncols) for row in rows]
+  for line in file:
+    line = line.rstrip('\r\n')
+    if line.startswith('>'):
+      if name is not None:
+        yield Puzzle()
+      name = line[1:].strip()
+      rows = []
+    else:
+      assert name is not None or line.strip() == '', "expected '>name' before the first puzzle, got %r" % (line,)
+      rows.append(line)
+  if name is not None:
+    yield Puzzle()
+
+def WritePuzzles(file, namesAndInputs):
+  for name,input in namesAndInputs:
+    file.write('>%s\n' % name)
+    for row in input:
+      file.write('%s\n' % row)
+    file.flush()
+
+if True:
+  assert list(ReadPuzzles(['>a\n', '*\n', '>b\n', '  *\n', '*\n', '\n'])) == [('a', ['*']), ('b', ['  *', '*  '])]
+  output = io.StringIO()
+  WritePuzzles(output, namesAndInputs[:3])
+  assert list(ReadPuzzles(io.StringIO(output.getvalue()))) == [(name,input) for name,input in namesAndInputs[:3]]
+
+# Generating synthetic puzzles, for load and scaling tests.
+# Nodes are a random node_density of the lattice points (irow odd, icol odd,
+# irow-icol a multiple of 4), inside a 1-char border that leaves room for the digits.
+# Consecutive nodes along a S, SE or SW line get an edge with probability edge_density;
+# an edge that passes through empty lattice points, where it may cross other edges,
+# is also subject to crossing_density.  Where edges cross, a random one is on top.
+# The entrance and exit are (node, direction)s without an edge, drawn as in dirss:
+# anywhere if placement='random', or as high and as low as possible if placement='opposite'.
+# If solvable, they're connected in MakeSubgraph's subgraph (note process() asserts
+# that puzzles without crossings are solvable).
+# Returns the input, as nrows strings of ncols chars; the same args always give the same input.
+def GeneratePuzzle(nrows, ncols, seed=0, node_density=0.5, edge_density=0.5, crossing_density=0.5, placement='random', solvable=True):
+  assert nrows >= 3 and ncols >= 3, "a puzzle must be at least 3x3, to have room for a node"
+  assert placement in ('random', 'opposite'), "placement should be 'random' or 'opposite', not %r" % (placement,)
+  rng = random.Random(seed)
+  # (direction number, lattice step, stroke step, stroke char)
+  edge_dirs = [(3,(4,0),(1,0),'|'), (2,(2,2),(1,1),'\\'), (4,(2,-2),(1,-1),'/')]
+  for attempt in range(100):
+    input = [[' ']*ncols for irow in range(nrows)]
+    nodes = []
+    for irow in range(1, nrows-1, 2):
+      for icol in range(1 + (irow-1)%4, ncols-1, 4):
+        if rng.random() < node_density:
+          input[irow][icol] = '*'
+          nodes.append((irow,icol))
+    node2index = dict((node,i) for i,node in enumerate(nodes))
+
+    # Walk down each line from each node to the next node on it, if any.
+    edges = []
+    strokes = []  # (cells, char) of each edge
+    for inode0,(irow0,icol0) in enumerate(nodes):
+      for idir,(lattice_deltarow,lattice_deltacol),(deltarow,deltacol),c in edge_dirs:
+        irow1,icol1 = irow0+lattice_deltarow,icol0+lattice_deltacol
+        while 1 <= irow1 < nrows-1 and 1 <= icol1 < ncols-1 and (irow1,icol1) not in node2index:
+          irow1,icol1 = irow1+lattice_deltarow,icol1+lattice_deltacol
+        if (irow1,icol1) not in node2index:
+          continue
+        crosses = irow1-irow0 > abs(lattice_deltarow)
+        if rng.random() < edge_density and (not crosses or rng.random() < crossing_density):
+          edges.append((inode0,node2index[(irow1,icol1)]))
+          strokes.append(([(irow0+i*deltarow,icol0+i*deltacol) for i in range(1,irow1-irow0)], c))
+    # Crossings are at lattice points, so this only decides which edge is on top there.
+    rng.shuffle(strokes)
+    for cells,c in strokes:
+      for irow,icol in cells:
+        input[irow][icol] = c
+    edges.sort()
 
-  if True:
-    entrances_and_exits = []
-    # Find entrances/exits.
-    # These are numbers near nodes, roughly in the numbered direction from the node,
-    # although sometimes a bit off in order to work around essential parts of the picture.
-    for irow in range(len(input)):
-      for icol in range(len(input[irow])):
-        c = input[irow][icol]
-        if c in '0123456':
-          print("  found %r at irow=%d icol=%d" % (c, irow, icol))
-          dirss = [
-            ((-1,0),),
-            ((-1,1),(0,1)),
-            ((1,1),(0,1)),
-            ((1,0),),
-            ((1,-1),(0,-1)),
-            ((-1,-1),(0,-1)),
-          ]
-          dirs = dirss[int(c)]
-          inode = None
-          for dir in dirs:
-            rough_irow = irow - dir[0]
-            rough_icol = icol - dir[1]
-            print("      rough_irow = %r" % rough_irow)
-            print("      rough_icol = %r" % rough_icol)
-            if (rough_irow,rough_icol) in node2index:
-              assert inode == None
-              inode = node2index[(rough_irow,rough_icol)]
-          assert inode is not None
-          entrances_and_exits.append((inode,int(c)))
-    print("      entrances_and_exits = %r" % (entrances_and_exits,))
-
-  if name != 'input73':  # TODO: picture screws up for some reason, fix!
-    picture = MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entrances_and_exits, slack)
-
-    if True:
-      # Show the picture
-      n_rows_out = len(picture)
-      n_cols_out = len(picture[0])
-      print("##" + "#"*n_cols_out  + "##")
-      for line in picture:
-        print("# %s #" % line)
-      print("##" + "#"*n_cols_out  + "##")
+    syndromes = ComputeSyndromes(nodes, edges)
+    candidates = [(inode,idir) for inode in range(len(nodes)) for idir in range(6) if not (syndromes[inode]>>idir)&1]
+    if solvable:
+      subnodes,subnode2index,subedges = MakeSubgraph(nodes, edges, syndromes)
+      parents,sizes = MakeComponents(len(subnodes), subedges)
+      candidate2component = lambda candidate: FindRoot(parents, EntranceSubnodeIndex(subnode2index, *candidate))
+    else:
+      candidate2component = lambda candidate: 0
+    component2candidates = collections.defaultdict(list)
+    for candidate in candidates:
+      component2candidates[candidate2component(candidate)].append(candidate)
+
+    def DigitCell(candidate):
+      inode,idir = candidate
+      return (nodes[inode][0]+dirss[idir][0][0], nodes[inode][1]+dirss[idir][0][1])
+    # In order of each component's first candidate, which doesn't depend on how components are labeled.
+    usable = [component for component,members in component2candidates.items()
+              if len(set(map(DigitCell, members))) >= 2]
+    if len(usable) == 0:
+      continue
+    if placement == 'random':
+      members = component2candidates[rng.choice(usable)]
+      entrance = rng.choice(members)
+      others = [member for member in members if DigitCell(member) != DigitCell(entrance)]
+      exit = rng.choice(others)
+    else:
+      def Spread(component):
+        rows = [nodes[inode][0] for inode,idir in component2candidates[component]]
+        return max(rows)-min(rows)
+      best_spread = max(map(Spread, usable))
+      members = component2candidates[rng.choice([component for component in usable if Spread(component) == best_spread])]
+      minrow = min(nodes[inode][0] for inode,idir in members)
+      entrance = rng.choice([member for member in members if nodes[member[0]][0] == minrow])
+      others = [member for member in members if DigitCell(member) != DigitCell(entrance)]
+      maxrow = max(nodes[inode][0] for inode,idir in others)
+      exit = rng.choice([member for member in others if nodes[member[0]][0] == maxrow])
+    for inode,idir in (entrance,exit):
+      irow,icol = DigitCell((inode,idir))
+      assert input[irow][icol] == ' '
+      input[irow][icol] = str(idir)
+    return [''.join(line) for line in input]
+  assert False, "couldn't generate a %dx%d puzzle with an entrance and exit in 100 attempts" % (nrows, ncols)
+
+# On-disk cache of the results of process()'s stages, keyed by content (see CacheKey),
+# so re-running a puzzle can skip stages whose inputs haven't changed.
+# Each entry is a pickle file in the cache directory.  Reading an entry bumps
+# its mtime, and every so often writing one evicts the least recently used
+# entries until the directory holds at most cache_max_bytes.
+# Entries are written to a temporary file and renamed into place, so that
+# concurrent processes (e.g. RunBatch workers) never see partial entries;
+# entries that vanish because another process evicted them are just misses.
+cache_max_bytes = 1<<30  # can be overridden by --cache-max-mb=<megabytes>
+cache_evict_interval = 64  # number of CachePuts between evictions
+cache_nputs = 0
+code_version_salt = None  # hash of this file, so that changing the code invalidates the cache
+
+# Key for a stage's result, as a function of the stage name and everything it depends on.
+def CacheKey(stage, *parts):
+  global code_version_salt
+  if code_version_salt is None:
+    with open(__file__, 'rb') as f:
+      code_version_salt = hashlib.sha256(f.read()).hexdigest()
+  return stage + '-' + hashlib.sha256(repr((code_version_salt,)+parts).encode('utf-8')).hexdigest()
+
+# The cached value for key, or None if there isn't one (or cache_dir is None).
+def CacheGet(cache_dir, key):
+  if cache_dir is None:
+    return None
+  filename = os.path.join(cache_dir, key+'.pickle')
+  try:
+    with open(filename, 'rb') as f:
+      value = pickle.load(f)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    return None
+  try:
+    os.utime(filename)
+  except OSError:
+    pass
+  Log('main', LOG_PROGRESS, "      cache hit: %s", key)
+  return value
+
+def CachePut(cache_dir, key, value):
+  global cache_nputs
+  if cache_dir is None:
+    return
+  os.makedirs(cache_dir, exist_ok=True)
+  fd,tempname = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+  with os.fdopen(fd, 'wb') as f:
+    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tempname, os.path.join(cache_dir, key+'.pickle'))
+  cache_nputs += 1
+  if cache_nputs % cache_evict_interval == 0:
+    CacheEvict(cache_dir)
+
+def CacheEvict(cache_dir):
+  entries = []  # (mtime, path, size)
+  total_size = 0
+  for entry in os.scandir(cache_dir):
+    if entry.name.endswith('.pickle'):
+      try:
+        stat = entry.stat()
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, entry.path, stat.st_size))
+      total_size += stat.st_size
+  entries.sort()
+  for mtime,path,size in entries:
+    if total_size <= cache_max_bytes:
+      break
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    total_size -= size
+
+# Log the solution for a path of subnodes (inode, xyz offset): the nodes it goes through,
+# as directions to follow, forward and then backward.
+def LogSolution(nodes, path):
+  # TODO: Remove path elements that are not direction changes.
+  # How do I detect that??
+  #path = [path[i] for i in range(len(path)) if i==0 or i==len(path)-1 or AreCollinear(... huh? ...)
+  nodepath = []
+  for inode,something in path:
+    if len(nodepath) == 0 or inode != nodepath[-1]:
+      nodepath.append(inode)
+  Log('solution', LOG_PROGRESS, "      nodepath = %r", nodepath)
+
+  for forward_then_backward in range(2):
+    Log('solution', LOG_SOLUTION, "          ======")
+    Log('solution', LOG_SOLUTION, "          start at node %d", nodepath[0])
+    for i in range(len(nodepath)-1):
+      dirname = FindDirName(nodes[nodepath[i]],nodes[nodepath[i+1]])
+      Log('solution', LOG_SOLUTION, "          go %s to node %d", dirname, nodepath[i+1])
+    Log('solution', LOG_SOLUTION, "          ======")
+    nodepath.reverse()
+
+# If count is not None, also count the shortest solutions (see MakeNodepathLayers) and list the first count of them.
+def process(name, input, slack, canvas='list', search='bfs', graph='explicit', cache=None, count=None):
+  Log('main', LOG_PROGRESS, "    in process(name=%s)", name)
+  timings = []  # (stage name, seconds)
+  stage_start_time = time.perf_counter()
+  def EndStage(stage_name):
+    nonlocal stage_start_time
+    now = time.perf_counter()
+    timings.append((stage_name, now-stage_start_time))
+    stage_start_time = now
+
+  # Each stage's result is cached separately, so that e.g. changing slack
+  # reuses the cached graph and path.
+  parsed = CacheGet(cache, CacheKey('graph', input))
+  if parsed is None:
+    parsed = ParseInput(input)
+    CachePut(cache, CacheKey('graph', input), parsed)
+  nodes,edges,edge_precedences_back_to_front,entrances_and_exits = parsed
+  node2index = dict((node,i) for i,node in enumerate(nodes))
+  EndStage('parse')
 
+  picture = CacheGet(cache, CacheKey('picture', input, slack))
+  if picture is None:
+    picture = MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entrances_and_exits, slack, canvas)
+    CachePut(cache, CacheKey('picture', input, slack), picture)
 
   if True:
+    # Show the picture
+    n_rows_out = len(picture)
+    n_cols_out = len(picture[0])
+    Log('picture', LOG_PROGRESS, "##%s##", "#"*n_cols_out)
+    for line in picture:
+      Log('picture', LOG_PROGRESS, "# %s #", line)
+    Log('picture', LOG_PROGRESS, "##%s##", "#"*n_cols_out)
+  EndStage('picture')
+
+  # The paths are cached with the counted solutions, (nsolutions, nodepaths) or None.
+  cached_paths = CacheGet(cache, CacheKey('path', input, search, graph, count))
+  if cached_paths is not None:
+    paths,counted = cached_paths
+  else:
     syndromes = ComputeSyndromes(nodes, edges)
-    # See if I can actually make the maze.
-    # Not sure what subnodes should be yet.
-    # Try [inode, xyz offset].
-    subnodes = []
-    idir2dir = ((0,0,1),(-1,0,0),(0,1,0),(0,0,-1),(1,0,0),(0,-1,0))
-    for inode,node in enumerate(nodes):
-      syndrome = syndromes[inode]
-      for idir in range(6):
-        if syndrome[idir]:
-          for jdir in range(6):
-            if idir%3 != jdir%3:
-              diri = idir2dir[idir]
-              dirj = idir2dir[jdir]
-              subnodes.append((inode,(diri[0]+dirj[0],diri[1]+dirj[1],diri[2]+dirj[2])))
-        else:
-          subnodes.append((inode,idir2dir[idir]))
-    print("      len(subnodes) = %r" % (len(subnodes),))
-    print("      subnodes = %r" % (subnodes,))
-    subnodes = sorted(set(subnodes))
-    print("      len(subnodes) = %r" % (len(subnodes),))
-    print("      subnodes = %r" % (subnodes,))
-    subnode2index = dict((subnode,i) for i,subnode in enumerate(subnodes))
-    print("      subnode2index = %r" % (subnode2index,))
-    subedges = []
-    for isubnode,(inode,(x,y,z)) in enumerate(subnodes):
-      for d in ((-1,0,0),(1,0,0),(0,-1,0),(0,1,0),(0,0,-1),(0,0,1)):
-        otherx = x + d[0]
-        othery = y + d[1]
-        otherz = z + d[2]
-        if (inode,(otherx,othery,otherz)) in subnode2index:
-          #print("Hey! found %r and then %r" % ((inode,(x,y,z)),(inode,(otherx,othery,otherz))))
-          jsubnode = subnode2index[(inode,(otherx,othery,otherz))]
-          assert jsubnode != isubnode
-          if jsubnode > isubnode:  # undirected
-            subedges.append((isubnode, jsubnode))
-
-    # Simplistic, for starters: no interaction between crossed edges.
-    for inode0,inode1 in edges:
-      irow0,icol0 = nodes[inode0]
-      irow1,icol1 = nodes[inode1]
-      assert irow0 < irow1
-      if icol0 == icol1:
-        # S
-        subedges.append((subnode2index[(inode0,(1,0,-1))],
-                         subnode2index[(inode1,(1,0,1))]))
-        subedges.append((subnode2index[(inode0,(-1,0,-1))],
-                         subnode2index[(inode1,(-1,0,1))]))
-        subedges.append((subnode2index[(inode0,(0,1,-1))],
-                         subnode2index[(inode1,(0,1,1))]))
-        subedges.append((subnode2index[(inode0,(0,-1,-1))],
-                         subnode2index[(inode1,(0,-1,1))]))
-      elif icol0 < icol1:
-        # SE
-        subedges.append((subnode2index[(inode0,(1,1,0))],
-                         subnode2index[(inode1,(1,-1,0))]))
-        subedges.append((subnode2index[(inode0,(-1,1,0))],
-                         subnode2index[(inode1,(-1,-1,0))]))
-        subedges.append((subnode2index[(inode0,(0,1,1))],
-                         subnode2index[(inode1,(0,-1,1))]))
-        subedges.append((subnode2index[(inode0,(0,1,-1))],
-                         subnode2index[(inode1,(0,-1,-1))]))
-      else:
-        # SW
-        subedges.append((subnode2index[(inode0,(1,1,0))],
-                         subnode2index[(inode1,(-1,1,0))]))
-        subedges.append((subnode2index[(inode0,(1,-1,0))],
-                         subnode2index[(inode1,(-1,-1,0))]))
-        subedges.append((subnode2index[(inode0,(1,0,1))],
-                         subnode2index[(inode1,(-1,0,1))]))
-        subedges.append((subnode2index[(inode0,(1,0,-1))],
-                         subnode2index[(inode1,(-1,0,-1))]))
-    subedges = sorted(set(subedges))
-    print("      subedges = %r" % (subedges,))
-    #for i,subedge in enumerate(subedges):
-    #  print("          %d: %r -> %r" % (i, subnodes[subedge[0]], subnodes[subedge[1]]))
-
+    if graph == 'explicit':
+      subnodes,subnode2index,subedges = MakeSubgraph(nodes, edges, syndromes)
+      adjacency = MakeAdjacency(len(subnodes), subedges)
+      parents,sizes = MakeComponents(len(subnodes), subedges)
+      Log('subgraph', LOG_PROGRESS, "      ncomponents = %r", lambda:sum(1 for i,parent in enumerate(parents) if parent == i))
+    else:
+      assert graph == 'implicit', "graph should be 'explicit' or 'implicit', not %r" % (graph,)
+      assert search == 'bfs', "graph='implicit' only supports search='bfs'"
+      implicit_graph = MakeImplicitGraph(nodes, edges, syndromes)
+    EndStage('subgraph')
 
     # Okay, we have subnodes and subedges.
-    # Can we find the path between entrance and exit??
-    def FindShortestPath(edges,node0,node1,node2string):
-      verbose_level = 1
-      if verbose_level >= 1: print("        in FindShortestPath")
-      if verbose_level >= 1: print("          node0 = %r: %r" % (node0,node2string(node0)))
-      if verbose_level >= 1: print("          node1 = %r: %r" % (node1,node2string(node1)))
-      if node1 == node0:
-        if verbose_level >= 1: print("        out FindShortestPath, trivial")
-        return [node0]
-      neighbors = {}
-      for a,b in edges:
-        if a not in neighbors: neighbors[a] = set()
-        if b not in neighbors: neighbors[b] = set()
-        neighbors[a].add(b)
-        neighbors[b].add(a)
-      # Search outward from node0.
-      node2pred = {node0:None}
-      the_list = [node0]
-      the_set = set([node0])
-      i = 0
-      while i < len(the_list):
-        a = the_list[i]
-        if verbose_level >= 2: print("          a = %r: %s" % (a,node2string(a)))
-        for b in neighbors[a]:
-          if b not in the_set:
-            if verbose_level >= 2: print("              b = %r: %s" % (b,node2string(b)))
-            the_set.add(b)
-            the_list.append(b)
-            node2pred[b] = a
-            if b == node1:
-              if verbose_level >= 2: print("              done! because b=%r == node1=%r" % (b,node1))
-              break
-          else:
-            if verbose_level >= 2: print("              (b = %r seen already)" % (b,))
-            pass
-        if the_list[-1] == node1:
-          if verbose_level >= 2: print("          done!")
-          break
-        i += 1
-      if the_list[-1] == node1:
-        # Found a path!
-        assert the_list[-1] == node1
-        answer = [node1]
-        while answer[-1] != node0:
-          answer.append(node2pred[answer[-1]])
-        answer.reverse()
-        if verbose_level >= 1: print("        out FindShortestPath, found it!")
-        return answer
+    # Can we find the paths between the entrances and exits??
+    # paths[(i,j)] for i < j is the path from entrances_and_exits[i] to entrances_and_exits[j], or None.
+    paths = {}
+    counted = None
+    entrance_subnodes = [(inode,idir2dir[idir]) for inode,idir in entrances_and_exits]
+    assert len(set(entrance_subnodes)) == len(entrance_subnodes)
+    if len(entrances_and_exits) == 2:
+      subnode0,subnode1 = entrance_subnodes
+      path = None
+      if graph == 'explicit':
+        isubnode0,isubnode1 = [EntranceSubnodeIndex(subnode2index, inode, idir) for inode,idir in entrances_and_exits]
+        # Only search if there's something to find.
+        root0,root1 = FindRoot(parents, isubnode0),FindRoot(parents, isubnode1)
+        Log('search', LOG_PROGRESS, "      entrance is in component %d (%d subnodes), exit is in component %d (%d subnodes)", root0, sizes[root0], root1, sizes[root1])
+        if root0 == root1:
+          path = searches[search](adjacency,isubnode0,isubnode1, lambda isubnode:'%r'%(DecodeSubnode(subnodes[isubnode]),), **SearchKwargs(search, nodes, edges, subnodes))
+        Log('search', LOG_DETAIL, "      path = %r", path)
+        if path is not None:
+          # Convert from index to value
+          path = [DecodeSubnode(subnodes[i]) for i in path]
+        if count is not None:
+          layers = MakeNodepathLayers(adjacency, subnodes, isubnode0, isubnode1)
+          counted = CountShortestNodepaths(layers),list(itertools.islice(GenerateShortestNodepaths(layers), count))
       else:
-        if verbose_level >= 1: print("        out FindShortestPath, didn't find it")
-        return None
-
-    def FindDirName(node0,node1):
-      row0,col0 = node0
-      row1,col1 = node1
-      if col0 == col1:
-        if row0 < row1:
-          return "S"
-        else:
-          return "N"
-      elif col0 < col1:
-        if row0 < row1:
-          return "SE"
-        else:
-          return "NE"
+        assert count is None, "graph='implicit' doesn't support count"
+
+        path = FindShortestPathImplicit(implicit_graph,subnode0,subnode1)
+        if path is None:
+          Log('search', LOG_DETAIL, "      path = %r", path)
+      paths[(0,1)] = path
+    elif len(entrances_and_exits) > 2:
+      assert graph == 'explicit', "graph='implicit' only supports two entrances/exits"
+      assert search == 'bfs', "search=%r only supports two entrances/exits" % (search,)
+      assert count is None, "count needs exactly two entrances/exits"
+      isubnodes = [EntranceSubnodeIndex(subnode2index, inode, idir) for inode,idir in entrances_and_exits]
+      distances,preds = FindAllPairsShortestPaths(adjacency, isubnodes, (parents,sizes))
+      Log('search', LOG_PROGRESS, "      distances = %r", distances)
+      for i in range(len(isubnodes)):
+        for j in range(i+1, len(isubnodes)):
+          path = PathFromPreds(preds[i], isubnodes[i], isubnodes[j])
+          paths[(i,j)] = None if path is None else [DecodeSubnode(subnodes[k]) for k in path]
+    CachePut(cache, CacheKey('path', input, search, graph, count), (paths,counted))
+
+  for (i,j),path in sorted(paths.items()):
+    if len(entrances_and_exits) > 2:
+      Log('solution', LOG_SOLUTION, "      from entrance/exit %d to %d: %s", i, j, 'no path' if path is None else 'distance %d' % (len(path)-1))
+    if path is not None:
+      Log('search', LOG_DETAIL, "      path = %r", path)
+      LogSolution(nodes, path)
+  if counted is not None:
+    nsolutions,nodepaths = counted
+    Log('solution', LOG_SOLUTION, "      %d shortest solution%s (in node moves)", nsolutions, '' if nsolutions == 1 else 's')
+    for nodepath in nodepaths:
+      Log('solution', LOG_SOLUTION, "        nodepath = %r", nodepath)
+
+  if len(edge_precedences_back_to_front) == 0 and len(entrances_and_exits) == 2:  # XXX this is the only case where we get it right, so far
+    # There should be an answer!
+    assert paths[(0,1)] is not None
+  EndStage('search')
+
+  Log('timing', LOG_SOLUTION, "    timings: %s", lambda:', '.join('%s %.6fs' % timing for timing in timings))
+  Log('main', LOG_PROGRESS, "    out process(name=%s)", name)
+
+# Benchmarking.
+# Each stage of process() is run on its own, reps times, with logging off.
+# Yields json-able dicts: one per (puzzle, stage, slack) with the min, median and 95th
+# percentile seconds and the puzzle's sizes (slack is None for stages that don't depend on it),
+# then one per (stage, size measure) with a fit of median seconds = coefficient * size**exponent
+# over all the puzzles, to show how each stage scales.
+def Benchmark(namesAndInputs, reps, slacks, canvas='list', search='bfs'):
+  yield {'benchmark': 'hocus_solution', 'code_version': CacheKey('benchmark'), 'python': sys.version.split()[0],
+         'reps': reps, 'slacks': slacks, 'canvas': canvas, 'search': search}
+  def Time(stage_name, slack, function):
+    global default_log_level, log_levels
+    seconds = []
+    for rep in range(reps):
+      saved_log_settings = default_log_level,log_levels
+      default_log_level,log_levels = 0,{}
+      try:
+        start_time = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start_time)
+      except Exception as e:
+        return None,{'puzzle': name, 'stage': stage_name, 'slack': slack, 'error': repr(e)}
+      finally:
+        default_log_level,log_levels = saved_log_settings
+    seconds.sort()
+    record = {'puzzle': name, 'stage': stage_name, 'slack': slack, 'reps': reps,
+              'min': seconds[0],
+              'median': seconds[len(seconds)//2] if len(seconds)%2 == 1 else (seconds[len(seconds)//2-1]+seconds[len(seconds)//2])/2,
+              'p95': seconds[max(0, math.ceil(.95*len(seconds))-1)]}
+    return result,record
+  records = []
+  for name,input in namesAndInputs:
+    # Each stage needs the previous stages' results,
+    # so the first one that fails (other than picture) ends this puzzle.
+    puzzle_records = []
+    sizes = {'nrows': len(input), 'ncols': len(input[0]) if len(input) != 0 else 0}
+    def Stage(stage_name, slack, function):
+      result,record = Time(stage_name, slack, function)
+      puzzle_records.append(record)
+      return result,'error' not in record
+    lexed,ok = Stage('lex', None, lambda: LexInput(input))
+    if ok and len(lexed[3]) != 0:
+      puzzle_records[-1]['error'] = "bad chars (irow,icol,c) in input: %r" % (lexed[3],)
+      ok = False
+    if ok:
+      nodes,strokes,digits,errors = lexed
+      node2index = dict((node,i) for i,node in enumerate(nodes))
+      sizes['nnodes'] = len(nodes)
+      edges_and_labels,ok = Stage('edges', None, lambda: FindEdges(input,node2index,strokes))
+    if ok:
+      edges,labels = edges_and_labels
+      sizes['nedges'] = len(edges)
+      edge_precedences_back_to_front,ok = Stage('occlusions', None, lambda: find_occlusions(input,labels,strokes))
+    if ok:
+      entrances_and_exits,ok = Stage('entrances_and_exits', None, lambda: FindEntrancesAndExits(node2index,digits))
+    if ok:
+      for slack in slacks:
+        picture,picture_ok = Stage('picture', slack, lambda: MakePicture(nodes, node2index, edges, edge_precedences_back_to_front, entrances_and_exits, slack, canvas))
+        if picture_ok:
+          puzzle_records[-1]['canvas_area'] = len(picture)*len(picture[0])
+      def MakeSearchGraph():
+        subnodes,subnode2index,subedges = MakeSubgraph(nodes, edges, ComputeSyndromes(nodes, edges))
+        return subnodes,subnode2index,subedges,MakeAdjacency(len(subnodes), subedges)
+      search_graph,ok = Stage('subgraph', None, MakeSearchGraph)
+    if ok:
+      subnodes,subnode2index,subedges,adjacency = search_graph
+      components,ok = Stage('components', None, lambda: MakeComponents(len(subnodes), subedges))
+    if ok and len(entrances_and_exits) == 2:
+      sizes['nsubnodes'] = len(subnodes)
+      def Search():
+        isubnode0,isubnode1 = [EntranceSubnodeIndex(subnode2index, inode, idir) for inode,idir in entrances_and_exits]
+        return searches[search](adjacency,isubnode0,isubnode1,str,**SearchKwargs(search, nodes, edges, subnodes))
+      Stage('search', None, Search)
+    for record in puzzle_records:
+      record.update(sizes)
+      yield record
+    records += puzzle_records
+
+  # Least squares fit of log(median) = log(coefficient) + exponent*log(size).
+  for stage_name in ['lex', 'edges', 'occlusions', 'entrances_and_exits', 'picture', 'subgraph', 'components', 'search']:
+    for size_name in ['nnodes', 'nedges', 'canvas_area']:
+      points = [(math.log(record[size_name]),math.log(record['median'])) for record in records
+                if record['stage'] == stage_name and record.get(size_name,0) > 0 and record.get('median',0) > 0]
+      if len(points) < 2 or len(set(x for x,y in points)) < 2:
+        continue
+      xmean = sum(x for x,y in points) / len(points)
+      ymean = sum(y for x,y in points) / len(points)
+      exponent = sum((x-xmean)*(y-ymean) for x,y in points) / sum((x-xmean)**2 for x,y in points)
+      yield {'fit': stage_name, 'against': size_name, 'npoints': len(points),
+             'exponent': exponent, 'coefficient': math.exp(ymean - exponent*xmean)}
+
+# Run process() on one puzzle with its output captured, in a RunBatch worker.
+# settings are the values of worker_settings globals from the parent,
+# since the worker may not have inherited them.
+# Returns (output, error), where error is None or the traceback of whatever went wrong.
+worker_settings = ['default_log_level', 'log_levels', 'cache_max_bytes']
+def ProcessCaptured(name, input, kwargs, settings):
+  globals().update(settings)
+  output = io.StringIO()
+  error = None
+  with contextlib.redirect_stdout(output):
+    try:
+      process(name, input, **kwargs)
+    except Exception:
+      error = traceback.format_exc()
+  return output.getvalue(),error
+
+# Run process() on each of namesAndInputs (any iterable of (name,input)),
+# spread over njobs worker processes, printing each puzzle's output
+# in order as soon as it and all the puzzles before it are done.
+# A puzzle that raises, or that kills its worker process, is reported
+# rather than ending the run.  Returns the list of names that failed.
+def RunBatch(namesAndInputs, njobs, **kwargs):
+  settings = dict((setting,globals()[setting]) for setting in worker_settings)
+  executor = concurrent.futures.ProcessPoolExecutor(njobs)
+  # [i, name, input, future, suspect], in order.
+  # future is None if it needs to be (re)submitted.
+  pending = collections.deque()
+  namesAndInputs = enumerate(namesAndInputs)
+  exhausted = False
+  failures = []
+  while True:
+    # Keep a bounded number of puzzles in flight, so that memory
+    # doesn't grow with the number of puzzles.
+    # But while there are suspects (see below), run only them, one at a time.
+    while not exhausted and len(pending) < 2*njobs and not any(entry[4] for entry in pending):
+      next_one = next(namesAndInputs, None)
+      if next_one is None:
+        exhausted = True
       else:
-        assert col0 > col1
-        if row0 < row1:
-          return "SW"
+        i,(name,input) = next_one
+        pending.append([i, name, input, executor.submit(ProcessCaptured, name, input, kwargs, settings), False])
+    if len(pending) == 0:
+      break
+    entry = pending[0]
+    i,name,input,future,suspect = entry
+    if future is None:
+      entry[3] = future = executor.submit(ProcessCaptured, name, input, kwargs, settings)
+    try:
+      output,error = future.result()
+    except concurrent.futures.process.BrokenProcessPool:
+      # Some worker died (e.g. by a real stack overflow), taking the pool
+      # and everything in flight with it.  Unless this puzzle was running alone,
+      # we can't tell which one did it, so rerun each of them alone.
+      executor.shutdown(wait=False)
+      executor = concurrent.futures.ProcessPoolExecutor(njobs)
+      for other in pending:
+        if other[3] is not None and not (other[3].done() and other[3].exception() is None):
+          other[3] = None
+          other[4] = True
+      if not suspect:
+        continue
+      output,error = '', "worker process died while running this puzzle\n"
+    pending.popleft()
+    Log('main', LOG_SOLUTION, "  i = %d: %r", i, name)
+    sys.stdout.write(output)
+    if error is not None:
+      Log('main', LOG_SOLUTION, "    FAILED: %s", error.rstrip('\n').replace('\n', '\n    '))
+      failures.append(name)
+    sys.stdout.flush()
+  executor.shutdown()
+  if len(failures) != 0:
+    Log('main', LOG_SOLUTION, "  %d puzzles failed: %r", len(failures), failures)
+  return failures
+
+if __name__ == '__main__':
+  ninputs = None  # default is all, can be overridden on command line
+  slack = 0  # can be overridden by --slack=<slack>
+  canvas = 'list'  # can be overridden by --canvas=numpy
+  search = 'bfs'  # can be overridden by --search=<one of the keys of searches>
+  graph = 'explicit'  # can be overridden by --graph=implicit
+  njobs = None  # can be overridden by --jobs=<number of worker processes, or 0 for one per cpu>
+  cache = None  # can be overridden by --cache=<directory>
+  benchmark = False  # can be overridden by --benchmark, to print json timings of each stage instead of solving
+  reps = 5  # for --benchmark, can be overridden by --reps=<reps>
+  slacks = None  # for --benchmark, default is [slack], can be overridden by --slacks=<slack>,<slack>,...
+  generate = None  # can be overridden by --generate=<nrows>x<ncols>, to use generated puzzles instead of namesAndInputs
+  seed = 0  # for --generate, the first seed, can be overridden by --seed=<seed>
+  ngenerate = 1  # for --generate, the number of puzzles, with consecutive seeds, can be overridden by --ngenerate=<n>
+  generate_kwargs = {}  # for --generate, can be set by --node-density=, --edge-density=, --crossing-density=, --placement=
+  input_file = None  # can be overridden by --input=<file, or - for stdin>, to read puzzles (see ReadPuzzles) instead of using namesAndInputs
+  dump = False  # can be overridden by --dump, to write the puzzles (see WritePuzzles) instead of solving them
+  count = None  # can be overridden by --count=<K>, to count the shortest solutions and show the first K of them
+  for arg in sys.argv[1:]:
+    if arg.startswith('--slack='):
+      slack = int(arg.split('=')[1])
+    elif arg.startswith('--canvas='):
+      canvas = arg.split('=')[1]
+    elif arg.startswith('--search='):
+      search = arg.split('=')[1]
+      assert search in searches, "--search should be one of %r" % (sorted(searches),)
+    elif arg.startswith('--graph='):
+      graph = arg.split('=')[1]
+    elif arg.startswith('--cache='):
+      cache = arg.split('=')[1]
+    elif arg.startswith('--cache-max-mb='):
+      cache_max_bytes = int(float(arg.split('=')[1]) * (1<<20))
+    elif arg == '--benchmark':
+      benchmark = True
+    elif arg.startswith('--reps='):
+      reps = int(arg.split('=')[1])
+    elif arg.startswith('--slacks='):
+      slacks = [int(s) for s in arg.split('=')[1].split(',')]
+    elif arg.startswith('--generate='):
+      generate = tuple(int(n) for n in arg.split('=')[1].split('x'))
+    elif arg.startswith('--seed='):
+      seed = int(arg.split('=')[1])
+    elif arg.startswith('--ngenerate='):
+      ngenerate = int(arg.split('=')[1])
+    elif arg.split('=')[0] in ('--node-density', '--edge-density', '--crossing-density'):
+      generate_kwargs[arg.split('=')[0][2:].replace('-','_')] = float(arg.split('=')[1])
+    elif arg.startswith('--placement='):
+      generate_kwargs['placement'] = arg.split('=')[1]
+    elif arg.startswith('--input='):
+      input_file = arg.split('=',1)[1]
+    elif arg == '--dump':
+      dump = True
+    elif arg.startswith('--count='):
+      count = int(arg.split('=')[1])
+    elif arg.startswith('--jobs='):
+      njobs = int(arg.split('=')[1]) or os.cpu_count()
+    elif arg.startswith('--verbose='):
+      for setting in arg.split('=')[1].split(','):
+        if ':' in setting:
+          channel,level = setting.split(':')
+          log_levels[channel] = int(level)
         else:
-          return "NW"
-
-    if len(entrances_and_exits) != 0:
-      assert len(entrances_and_exits) == 2
-      isubnode0 = subnode2index[(entrances_and_exits[0][0],idir2dir[entrances_and_exits[0][1]])]
-      isubnode1 = subnode2index[(entrances_and_exits[1][0],idir2dir[entrances_and_exits[1][1]])]
-      assert isubnode0 != isubnode1
-
-      path = FindShortestPath(subedges,isubnode0,isubnode1, lambda isubnode:'%r'%(subnodes[isubnode],))
-      print("      path = %r" % (path,))
-      if path is not None:
-        # Convert from index to value
-        path = [subnodes[i] for i in path]
-        print("      path = %r" % (path,))
-        # TODO: Remove path elements that are not direction changes.
-        # How do I detect that??
-        #path = [path[i] for i in range(len(path)) if i==0 or i==len(path)-1 or AreCollinear(... huh? ...)
-        nodepath = []
-        for inode,something in path:
-          if len(nodepath) == 0 or inode != nodepath[-1]:
-            nodepath.append(inode)
-        print("      nodepath = %r" % (nodepath,))
-
-        for forward_then_backward in range(2):
-          print("          ======");
-          print("          start at node %d" % (nodepath[0],))
-          for i in range(len(nodepath)-1):
-            dirname = FindDirName(nodes[nodepath[i]],nodes[nodepath[i+1]])
-            print("          go %s to node %d" % (dirname, nodepath[i+1],))
-          print("          ======");
-          nodepath.reverse()
-          
-      if len(edge_precedences_back_to_front) == 0:  # XXX this is the only case where we get it right, so far
-        # There should be an answer!
-        assert path is not None
-          
-
-
-  print("    out process(name="+name+")")
-
-ninputs = None  # default is all, can be overridden on command line
-slack = 0  # can be overridden by --slack=<slack>
-for arg in sys.argv[1:]:
-  if arg.startswith('--slack='):
-    slack = int(arg.split('=')[1])
-  else:
-    ninputs = int(arg)
-
-if ninputs == None: ninputs = len(namesAndInputs)
-for i in range(ninputs):
-  name,input = namesAndInputs[i]
-  print("  i = %d: %r" % (i,name))
-  process(name, input, slack)
-
-
+          default_log_level = int(setting)
+    else:
+      ninputs = int(arg)
+
+  # The puzzles are read or generated lazily, one at a time, as they're needed.
+  if input_file is not None:
+    namesAndInputs = ReadPuzzles(sys.stdin if input_file == '-' else open(input_file))
+  elif generate is not None:
+    nrows,ncols = generate
+    namesAndInputs = (('generated_%dx%d_seed%d' % (nrows, ncols, seed+i), GeneratePuzzle(nrows, ncols, seed+i, **generate_kwargs))
+                      for i in range(ngenerate))
+  namesAndInputs = itertools.islice(namesAndInputs, ninputs)
+  if dump:
+    WritePuzzles(sys.stdout, namesAndInputs)
+    sys.exit(0)
+  if benchmark:
+    for record in Benchmark(namesAndInputs, reps, slacks or [slack], canvas, search):
+      print(json.dumps(record))
+      sys.stdout.flush()
+    sys.exit(0)
+  if njobs is not None:
+    failures = RunBatch(namesAndInputs, njobs, slack=slack, canvas=canvas, search=search, graph=graph, cache=cache, count=count)
+    if cache is not None:
+      CacheEvict(cache)
+    sys.exit(1 if len(failures) != 0 else 0)
+  for i,(name,input) in enumerate(namesAndInputs):
+    Log('main', LOG_SOLUTION, "  i = %d: %r", i,name)
+    process(name, input, slack, canvas, search, graph, cache, count)
+    sys.stdout.flush()
+  if cache is not None:
+    CacheEvict(cache)